@@ -7,7 +7,10 @@ from rest_framework.response import Response
 
 from common_users.api.serializers import CommonUserSerializer
 from common_users.models import CommonUser
-from services.telegram_chat_bot import process_telegram_event
+from services.telegram_chat_bot import (
+    check_webhook_secret,
+    process_telegram_event,
+)
 
 
 class CommonUserViewSet(
@@ -28,5 +31,10 @@ class CommonUserViewSet(
     )
     @action(methods=["POST"], detail=False, permission_classes=[AllowAny])
     def webhooks(self, request, *args, **kwargs):
+        secret_token = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
+
+        if not check_webhook_secret(secret_token):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
         process_telegram_event(request.data)
         return Response(status.HTTP_200_OK)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CommonUsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'common_users'
+
+    def ready(self):
+        from common_users import signals  # noqa: F401
@@ -0,0 +1,70 @@
+import asyncio
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from common_users.services.bot_tools import (
+    get_admins,
+    get_categories,
+    get_text_faq,
+)
+
+
+async def measure(call, users, rounds):
+    """returns latencies of ``users`` concurrent calls, ``rounds`` times"""
+    latencies = []
+
+    async def timed():
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+
+    for _ in range(rounds):
+        await asyncio.gather(*(timed() for _ in range(users)))
+
+    return latencies
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(int(len(values) * percent / 100), len(values) - 1)
+    return values[index]
+
+
+class Command(BaseCommand):
+    """Command"""
+
+    help = "Compare bot_tools latency under concurrent users"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options["users"], options["rounds"]))
+
+    async def run(self, users, rounds):
+        helpers = {
+            "get_categories": (get_categories, ()),
+            "get_text_faq": (get_text_faq, ()),
+            "get_admins": (get_admins, ()),
+        }
+
+        for name, (helper, args) in helpers.items():
+            # SyncToAsync keeps the undecorated function in ``func``
+            modes = {
+                "sync_to_async": sync_to_async(helper.func),
+                "db pool": helper,
+            }
+            for mode, call in modes.items():
+                latencies = await measure(
+                    lambda: call(*args), users=users, rounds=rounds
+                )
+                self.stdout.write(
+                    f"{name:<16} {mode:<14} "
+                    f"mean {statistics.mean(latencies) * 1000:8.2f} ms  "
+                    f"p50 {percentile(latencies, 50) * 1000:8.2f} ms  "
+                    f"p95 {percentile(latencies, 95) * 1000:8.2f} ms"
+                )
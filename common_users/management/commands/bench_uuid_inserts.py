@@ -0,0 +1,86 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from common_users.models import CommonUser, CommonUserPurchase
+from core.models.base import uuid7
+from orders.models import Category, Product
+
+GENERATORS = {
+    "uuid4": uuid.uuid4,
+    "uuid7": uuid7,
+}
+
+PREFIX = "bench-uuid"
+
+
+def get_index_size(model):
+    """returns bytes of the primary key index on Postgres, else None"""
+    if connection.vendor != "postgresql":
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT pg_relation_size(indexrelid)
+            FROM pg_index
+            WHERE indrelid = %s::regclass AND indisprimary
+            """,
+            [model._meta.db_table],
+        )
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    """Command"""
+
+    help = (
+        "Compare CommonUserPurchase.bulk_create throughput with random "
+        "(v4) and time-ordered (v7) primary keys"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument("--batch", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for name, generator in GENERATORS.items():
+            # every run starts from the same table and leaves nothing behind
+            with transaction.atomic():
+                seconds = self.insert(
+                    generator, options["rows"], options["batch"]
+                )
+                index_size = get_index_size(CommonUserPurchase)
+                transaction.set_rollback(True)
+
+            line = (
+                f"{name}  {options['rows']} rows  {seconds:.2f} s  "
+                f"{options['rows'] / seconds:,.0f} rows/s"
+            )
+            if index_size is not None:
+                line += f"  pkey index {index_size / 1024 / 1024:.1f} MB"
+            self.stdout.write(line)
+
+    def insert(self, generator, rows, batch):
+        user = CommonUser.objects.create(
+            username=PREFIX, telegram_user_id=PREFIX
+        )
+        product = Product.objects.create(
+            name=PREFIX, category=Category.objects.create(name=PREFIX)
+        )
+
+        started = time.perf_counter()
+        for offset in range(0, rows, batch):
+            CommonUserPurchase.objects.bulk_create(
+                CommonUserPurchase(
+                    id=generator(),
+                    user=user,
+                    product=product,
+                    quantity=1,
+                    amount=0,
+                )
+                for _ in range(min(batch, rows - offset))
+            )
+        return time.perf_counter() - started
@@ -0,0 +1,58 @@
+import pickle
+import uuid
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from common_users.services.cart import Cart, deep_size
+from orders.models import Product
+
+
+def legacy_cart(products, quantity):
+    """cart as stored before CartItem, with model instances inside"""
+    return {
+        str(product.id): {
+            "quantity": quantity,
+            "price": Decimal(settings.BASE_PRICE),
+            "product": product,
+            "total_price": Decimal(settings.BASE_PRICE) * quantity,
+        }
+        for product in products
+    }
+
+
+class Command(BaseCommand):
+    """Command"""
+
+    help = "Compare memory and pickled size of legacy and compact carts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=5)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        products = [
+            Product(id=uuid.uuid4(), name=f"A{index:03}", updated=now)
+            for index in range(options["items"])
+        ]
+
+        legacy = legacy_cart(products, quantity=2)
+        cart = Cart(SimpleNamespace(user_data={}))
+        for product in products:
+            cart.add(product, quantity=2)
+
+        rows = {
+            "legacy": (
+                deep_size(legacy),
+                len(pickle.dumps(legacy, protocol=pickle.HIGHEST_PROTOCOL)),
+            ),
+            "compact": (cart.memory_size(), cart.serialized_size()),
+        }
+
+        for name, (memory, serialized) in rows.items():
+            self.stdout.write(
+                f"{name:<8} memory {memory:8} B  pickled {serialized:8} B"
+            )
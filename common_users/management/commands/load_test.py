@@ -0,0 +1,445 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from common_users.management.commands.bench_bot_tools import percentile
+from common_users.management.commands.telegram_bot import build_application
+from common_users.models import BotConversation, BotUserData, CommonUser
+from common_users.services.fake_bot_api import FakeBotApi
+from common_users.services.pagination import NEXT
+from orders.models import Category, Product, Reservation
+
+PREFIX = "load"
+# synthetic telegram ids, far above the ids of real users
+FIRST_TELEGRAM_ID = 9 * 10**12
+TOOK_PLACE_PREFIX = "Занял место: "
+
+# report order of the funnel steps
+STEPS = (
+    "start",
+    "car_number",
+    "car_letters",
+    "car_region",
+    "phone",
+    "catalog",
+    "catalog_page",
+    "category",
+    "product",
+    "quantity",
+    "confirm",
+    "payment",
+    "pre_checkout",
+    "successful_payment",
+    "took_place",
+)
+
+
+class StepTimeout(Exception):
+    """the bot did not answer a step in time"""
+
+
+def is_answer(call):
+    return call.method in ("sendMessage", "editMessageText", "sendInvoice")
+
+
+def is_edit(call):
+    return call.method == "editMessageText"
+
+
+def has_button(data):
+    def predicate(call):
+        return is_answer(call) and any(
+            button_data == data for _, button_data in call.buttons
+        )
+
+    return predicate
+
+
+class SyntheticUser(object):
+    """Telegram user walking the booking funnel against the fake Bot API"""
+
+    def __init__(self, api, telegram_id, timeout, think, latencies):
+        self.api = api
+        self.id = telegram_id
+        self.timeout = timeout
+        self.think = think
+        self.latencies = latencies
+        self.user = {
+            "id": telegram_id,
+            "is_bot": False,
+            "first_name": "Load",
+            "last_name": str(telegram_id),
+            "username": f"{PREFIX}_{telegram_id}",
+        }
+        self.chat = {"id": telegram_id, "type": "private"}
+        self.inbox = api.chats[telegram_id]
+        self.message_ids = itertools.count(1)
+        self.updates = 0
+        # product names the bot confirmed as booked for this user
+        self.booked = []
+
+    def message(self, **fields):
+        return {
+            "message": {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": self.chat,
+                "from": self.user,
+                **fields,
+            }
+        }
+
+    def text(self, text, **fields):
+        return self.message(text=text, **fields)
+
+    def press(self, call, data):
+        return {
+            "callback_query": {
+                "id": self.api.new_query_id(self.id),
+                "from": self.user,
+                "chat_instance": str(self.id),
+                "message": call.message,
+                "data": data,
+            }
+        }
+
+    async def step(self, name, update, expect):
+        """push ``update``, returns the first bot call ``expect`` accepts"""
+        await asyncio.sleep(random.uniform(0, self.think))
+
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        await self.api.push_update(**update)
+        self.updates += 1
+
+        while True:
+            try:
+                call = await asyncio.wait_for(
+                    self.inbox.get(), deadline - time.perf_counter()
+                )
+            except asyncio.TimeoutError:
+                raise StepTimeout(name) from None
+
+            if expect(call):
+                self.latencies[name].append(call.received - started)
+                return call
+
+    async def run(self, category_name):
+        """walk from /start to "took place", returns the outcome"""
+        await self.step(
+            "start",
+            self.text(
+                "/start",
+                entities=[{"type": "bot_command", "offset": 0, "length": 6}],
+            ),
+            is_answer,
+        )
+        await self.step("car_number", self.text("123"), is_answer)
+        await self.step("car_letters", self.text("abc"), is_answer)
+        await self.step("car_region", self.text("01"), is_answer)
+        menu = await self.step(
+            "phone",
+            self.message(
+                contact={
+                    "phone_number": f"+7700{self.id % 10**7:07d}",
+                    "first_name": "Load",
+                    "user_id": self.id,
+                }
+            ),
+            has_button("catalog"),
+        )
+
+        page = await self.step("catalog", self.press(menu, "catalog"), is_edit)
+        while True:
+            buttons = dict(page.buttons)
+            if category_name in buttons:
+                break
+
+            next_page = next(
+                (
+                    data
+                    for data in buttons.values()
+                    if data.startswith(f"{NEXT}:")
+                ),
+                None,
+            )
+            if next_page is None:
+                return "no category"
+            page = await self.step(
+                "catalog_page", self.press(page, next_page), is_edit
+            )
+
+        products = await self.step(
+            "category", self.press(page, buttons[category_name]), is_edit
+        )
+        free = [
+            data
+            for _, data in products.buttons
+            if re.match(settings.BASE_PATTERN, data)
+        ]
+        if not free:
+            return "sold out"
+
+        detail = await self.step(
+            "product", self.press(products, random.choice(free)), is_answer
+        )
+        quantity = await self.step(
+            "quantity", self.press(detail, "1"), is_answer
+        )
+        if not has_button("confirm")(quantity):
+            return "busy"
+
+        cart = await self.step(
+            "confirm", self.press(quantity, "confirm"), has_button("payment")
+        )
+        invoice = await self.step(
+            "payment",
+            self.press(cart, "payment"),
+            lambda call: call.method == "sendInvoice"
+            or has_button("main_menu")(call),
+        )
+        if invoice.method != "sendInvoice":
+            return "taken before payment"
+
+        payload = invoice.params["payload"]
+        amount = invoice.message["invoice"]["total_amount"]
+        currency = invoice.params["currency"]
+        answer = await self.step(
+            "pre_checkout",
+            {
+                "pre_checkout_query": {
+                    "id": self.api.new_query_id(self.id),
+                    "from": self.user,
+                    "currency": currency,
+                    "total_amount": amount,
+                    "invoice_payload": payload,
+                }
+            },
+            lambda call: call.method == "answerPreCheckoutQuery",
+        )
+        if answer.params.get("ok") is not True:
+            return "hold expired"
+
+        booking = await self.step(
+            "successful_payment",
+            self.message(
+                successful_payment={
+                    "currency": currency,
+                    "total_amount": amount,
+                    "invoice_payload": payload,
+                    "telegram_payment_charge_id": f"{PREFIX}-{self.id}",
+                    "provider_payment_charge_id": f"{PREFIX}-{self.id}",
+                }
+            ),
+            has_button("main_menu"),
+        )
+        took_place = [
+            (text[len(TOOK_PLACE_PREFIX) :], data)
+            for text, data in booking.buttons
+            if text.startswith(TOOK_PLACE_PREFIX)
+        ]
+        if not took_place:
+            return "taken after payment"
+
+        self.booked = [name for name, _ in took_place]
+        await self.step(
+            "took_place", self.press(booking, took_place[0][1]), is_answer
+        )
+        return "booked"
+
+
+class Command(BaseCommand):
+    """Command"""
+
+    help = (
+        "Run synthetic users through the booking funnel of the bot against "
+        "a local fake Telegram Bot API, report latency per step and check "
+        "that no product is booked twice"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--products", type=int, default=20)
+        # seconds over which the users start
+        parser.add_argument("--ramp", type=float, default=5)
+        # longest pause of a user before each step, in seconds
+        parser.add_argument("--think", type=float, default=0.5)
+        # seconds to wait for the answer of one step
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--port", type=int, default=0)
+
+    def handle(self, *args, **options):
+        # per update info logs would drown the report
+        logging.getLogger().setLevel(logging.WARNING)
+
+        telegram_ids = [
+            FIRST_TELEGRAM_ID + index for index in range(options["users"])
+        ]
+        category, product_ids = self.setup(options["products"])
+
+        try:
+            results = asyncio.run(
+                self.run(category.name, telegram_ids, options)
+            )
+            self.report(*results)
+            self.verify(results[0], product_ids)
+        finally:
+            self.cleanup(category, telegram_ids)
+
+    def setup(self, products):
+        category = Category.objects.create(name=f"{PREFIX}-{time.time_ns()}")
+        product_ids = [
+            str(
+                Product.objects.create(
+                    name=f"{category.name}-{index}", category=category
+                ).id
+            )
+            for index in range(products)
+        ]
+        return category, product_ids
+
+    async def run(self, category_name, telegram_ids, options):
+        api = FakeBotApi()
+        await api.start(port=options["port"])
+        latencies = defaultdict(list)
+        users = [
+            SyntheticUser(
+                api,
+                telegram_id,
+                options["timeout"],
+                options["think"],
+                latencies,
+            )
+            for telegram_id in telegram_ids
+        ]
+
+        async def walk(user, delay):
+            await asyncio.sleep(delay)
+            try:
+                return await user.run(category_name)
+            except StepTimeout as exc:
+                return f"timeout at {exc}"
+
+        # jobs and the metrics listener of post_init belong to the real bot
+        application = build_application(base_url=api.base_url)
+        try:
+            async with application:
+                await application.updater.start_polling(poll_interval=0)
+                await application.start()
+                try:
+                    started = time.perf_counter()
+                    outcomes = await asyncio.gather(
+                        *(
+                            walk(user, options["ramp"] * index / len(users))
+                            for index, user in enumerate(users)
+                        )
+                    )
+                    elapsed = time.perf_counter() - started
+                finally:
+                    await application.updater.stop()
+                    await application.stop()
+        finally:
+            await api.stop()
+
+        return users, Counter(outcomes), elapsed, latencies, api.calls
+
+    def report(self, users, outcomes, elapsed, latencies, calls):
+        updates = sum(user.updates for user in users)
+        self.stdout.write(
+            f"{len(users)} users in {elapsed:.1f} s, "
+            f"{updates} updates ({updates / elapsed:.1f}/s), "
+            f"{outcomes['booked']} bookings "
+            f"({outcomes['booked'] / elapsed:.2f}/s)"
+        )
+        self.stdout.write(
+            f"{'step':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'p99 ms':>10}{'max ms':>10}"
+        )
+        for step in STEPS:
+            values = latencies.get(step)
+            if not values:
+                continue
+
+            self.stdout.write(
+                f"{step:<20}{len(values):>7}"
+                f"{percentile(values, 50) * 1000:>10.1f}"
+                f"{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}"
+                f"{max(values) * 1000:>10.1f}"
+            )
+
+        self.stdout.write(
+            "outcomes: "
+            + ", ".join(
+                f"{outcome} {count}" for outcome, count in outcomes.items()
+            )
+        )
+        self.stdout.write(
+            "bot api calls: "
+            + ", ".join(
+                f"{method} {count}" for method, count in sorted(calls.items())
+            )
+        )
+
+    def verify(self, users, product_ids):
+        claimed = Counter(name for user in users for name in user.booked)
+        double = [name for name, count in claimed.items() if count > 1]
+
+        owners = {name: str(user.id) for user in users for name in user.booked}
+        lessors = dict(
+            Product.objects.filter(
+                id__in=product_ids, lessor__isnull=False
+            ).values_list("name", "lessor__telegram_user_id")
+        )
+        stolen = [
+            name
+            for name, owner in owners.items()
+            if lessors.get(name) != owner
+        ]
+
+        overlapping = []
+        previous = None
+        for reservation in Reservation.objects.filter(
+            product_id__in=product_ids
+        ).order_by("product_id", "start"):
+            if (
+                previous is not None
+                and previous.product_id == reservation.product_id
+                and reservation.start < previous.end
+            ):
+                overlapping.append(str(reservation.product_id))
+            previous = reservation
+
+        self.stdout.write(
+            f"{len(claimed)} products booked, {len(double)} booked twice, "
+            f"{len(stolen)} owned by someone else, "
+            f"{len(overlapping)} overlapping reservations"
+        )
+
+        if double:
+            raise CommandError(f"Products booked twice: {double[:10]}")
+        if stolen:
+            raise CommandError(f"Booked products of others: {stolen[:10]}")
+        if overlapping:
+            raise CommandError(
+                f"Overlapping reservations of products: {overlapping[:10]}"
+            )
+
+    def cleanup(self, category, telegram_ids):
+        Product.objects.filter(category=category).delete()
+        category.delete()
+        CommonUser.objects.filter(
+            telegram_user_id__in=[str(user_id) for user_id in telegram_ids]
+        ).delete()
+        BotUserData.objects.filter(telegram_user_id__in=telegram_ids).delete()
+        BotConversation.objects.filter(
+            key__in=[json.dumps([user_id]) for user_id in telegram_ids]
+        ).delete()
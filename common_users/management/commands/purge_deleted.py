@@ -0,0 +1,108 @@
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.models.base import BaseModel
+
+# purchase history is kept even when soft deleted
+KEEP_MODELS = ("common_users.CommonUserPurchase", "orders.Reservation")
+
+
+def children_first(models):
+    """order models so that rows referencing others are purged first"""
+    ordered = []
+    seen = set()
+
+    def visit(model):
+        if model in seen:
+            return
+        seen.add(model)
+        for relation in model._meta.related_objects:
+            if relation.related_model in models:
+                visit(relation.related_model)
+        ordered.append(model)
+
+    for model in models:
+        visit(model)
+    return ordered
+
+
+def get_manager(model):
+    """returns manager of live and soft deleted rows of model"""
+    if issubclass(model, BaseModel):
+        return model.all_objects
+    return model._base_manager
+
+
+def unreferenced(model, queryset):
+    """
+    rows of ``queryset`` nothing points to, deleting a referenced row
+    would cascade to (or null the links of) live rows and history
+    """
+    for relation in model._meta.related_objects:
+        referencing = get_manager(relation.related_model).filter(
+            **{relation.field.name: OuterRef("pk")}
+        )
+        queryset = queryset.filter(~Exists(referencing))
+    return queryset
+
+
+class Command(BaseCommand):
+    """Command"""
+
+    help = (
+        "Permanently delete rows soft deleted more than --days ago, "
+        "in batches. Rows other rows still point to and purchase history "
+        "are kept"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.SOFT_DELETE_RETENTION_DAYS
+        )
+        parser.add_argument("--batch", type=int, default=1000)
+        # seconds to pause between batches to let other writers through
+        parser.add_argument("--sleep", type=float, default=0.1)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+
+        models = [
+            model
+            for model in apps.get_models()
+            if issubclass(model, BaseModel)
+            and model._meta.label not in KEEP_MODELS
+        ]
+
+        for model in children_first(models):
+            purged = self.purge(
+                model, cutoff, options["batch"], options["sleep"]
+            )
+            if purged:
+                self.stdout.write(f"{model._meta.label}: {purged}")
+
+    def purge(self, model, cutoff, batch, sleep):
+        deleted = unreferenced(
+            model,
+            model.all_objects.filter(is_deleted=True, updated__lt=cutoff),
+        )
+        purged = 0
+
+        while True:
+            # short transactions keep the row locks of a batch brief
+            with transaction.atomic():
+                pks = list(deleted.values_list("pk", flat=True)[:batch])
+                if not pks:
+                    return purged
+
+                # checked again in case a reference appeared meanwhile
+                deleted.filter(pk__in=pks).delete()
+                purged += len(pks)
+
+            time.sleep(sleep)
@@ -0,0 +1,165 @@
+import multiprocessing
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.utils import timezone
+
+from common_users.models import CommonUser
+from orders.models import Category, Product
+
+PREFIX = "stress"
+
+
+def reserve_worker(user_id, product_ids, rounds, size, barrier, results):
+    """claim random products every round, report what was claimed"""
+    claimed = []
+
+    try:
+        user = CommonUser.objects.get(id=user_id)
+
+        for round_number in range(rounds):
+            # the barrier frees all products once every process is here
+            barrier.wait()
+            wanted = random.sample(product_ids, size)
+            expiration_date = timezone.now() + timedelta(minutes=5)
+
+            while True:
+                try:
+                    ids = Product.objects.reserve(
+                        wanted, user, expiration_date
+                    )
+                    break
+                except OperationalError:
+                    # SQLite reports lock timeouts instead of waiting
+                    time.sleep(0.01)
+
+            claimed.extend(
+                (round_number, str(product_id)) for product_id in ids
+            )
+    finally:
+        barrier.abort()
+        connections.close_all()
+        results.put((user_id, claimed))
+
+
+class Command(BaseCommand):
+    """Command"""
+
+    help = (
+        "Reserve the same products from many processes at once and check "
+        "that no product is booked twice"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=16)
+        parser.add_argument("--products", type=int, default=20)
+        parser.add_argument("--rounds", type=int, default=50)
+        parser.add_argument("--size", type=int, default=3)
+
+    def handle(self, *args, **options):
+        processes = options["processes"]
+        rounds = options["rounds"]
+
+        category, users, product_ids = self.setup(
+            processes, options["products"]
+        )
+
+        try:
+            barrier = multiprocessing.Barrier(
+                processes, action=self.reset_products(product_ids)
+            )
+            results = multiprocessing.Queue()
+            connections.close_all()
+
+            workers = [
+                multiprocessing.Process(
+                    target=reserve_worker,
+                    args=(
+                        str(user.id),
+                        product_ids,
+                        rounds,
+                        options["size"],
+                        barrier,
+                        results,
+                    ),
+                )
+                for user in users
+            ]
+            for worker in workers:
+                worker.start()
+
+            claims = dict(results.get() for _ in workers)
+            for worker in workers:
+                worker.join()
+
+            if any(worker.exitcode for worker in workers):
+                raise CommandError("A reservation process failed")
+
+            self.verify(claims, rounds, product_ids)
+        finally:
+            Product.objects.filter(category=category).delete()
+            category.delete()
+            CommonUser.objects.filter(username__startswith=PREFIX).delete()
+
+    def setup(self, processes, products):
+        category = Category.objects.create(name=f"{PREFIX}-{time.time_ns()}")
+        users = [
+            CommonUser.objects.create(
+                username=f"{PREFIX}-{index}",
+                telegram_user_id=f"{PREFIX}-{index}",
+            )
+            for index in range(processes)
+        ]
+        product_ids = [
+            str(
+                Product.objects.create(
+                    name=f"{category.name}-{index}", category=category
+                ).id
+            )
+            for index in range(products)
+        ]
+        return category, users, product_ids
+
+    @staticmethod
+    def reset_products(product_ids):
+        def reset():
+            # runs in the last process reaching the barrier
+            Product.objects.filter(id__in=product_ids).update(
+                is_free=True, lessor=None, expiration_date=None
+            )
+
+        return reset
+
+    def verify(self, claims, rounds, product_ids):
+        claimed = Counter(
+            claim for user_claims in claims.values() for claim in user_claims
+        )
+        double = [claim for claim, count in claimed.items() if count > 1]
+
+        # the products booked by the last round belong to their claimers
+        owners = {
+            product_id: user_id
+            for user_id, user_claims in claims.items()
+            for round_number, product_id in user_claims
+            if round_number == rounds - 1
+        }
+        lessors = {
+            str(product_id): str(lessor_id)
+            for product_id, lessor_id in Product.objects.filter(
+                id__in=product_ids, lessor__isnull=False
+            ).values_list("id", "lessor_id")
+        }
+        if lessors != owners:
+            raise CommandError("Booked products do not match the claims")
+
+        self.stdout.write(
+            f"{len(claims)} processes, {rounds} rounds, "
+            f"{len(claimed)} claims, {len(double)} double bookings"
+        )
+
+        if double:
+            raise CommandError(f"Products booked twice: {double[:10]}")
@@ -1,9 +1,14 @@
+import asyncio
+import functools
 import logging
 import textwrap
 import re
+import time
+from datetime import timedelta
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
 
 from telegram import (
     InlineKeyboardButton,
@@ -29,10 +34,12 @@ from common_users.services.bot_tools import (
     build_menu,
     create_user,
     create_purchase,
+    extend_hold,
     get_cart_products_info,
     get_categories,
-    update_product_expiration_date,
-    get_product_detail,
+    get_expiring_products,
+    get_pending_expirations,
+    get_reminder_date,
     get_product_info_for_payment,
     get_product_name,
     get_products,
@@ -43,7 +50,40 @@ from common_users.services.bot_tools import (
     complete_purchase,
     get_user_products,
     get_admins,
+    hold_cart_products,
+    is_product_free,
+    release_expired_products,
+    render_list_page,
 )
+from common_users.services.application import (
+    ReloadableConversationHandler,
+    UserOrderedApplication,
+)
+from common_users.services.db import database_sync_to_async
+from common_users.services.metrics import (
+    EXPIRY_JOB_SECONDS,
+    EXPIRY_RELEASED,
+    HANDLER_ERRORS,
+    OUTBOUND_QUEUE_DEPTH,
+    UPDATE_QUEUE_DEPTH,
+    USER_QUEUE_UPDATES,
+    metrics_server,
+)
+from common_users.services.query_budget import (
+    instrument_conversation,
+    query_budget,
+)
+from common_users.services.expiry_scheduler import (
+    expiry_scheduler,
+    reminder_scheduler,
+)
+from common_users.services.leader import maintenance_lease
+from common_users.services.notifications import group_by_user, notify_users
+from common_users.services.pagination import NEXT, parse_page_callback
+from common_users.services.persistence import DjangoPersistence
+from common_users.services.rate_limiter import get_rate_limiter
+from common_users.services.tracing import finish_conversation, tracer
+from common_users.services.sharding import Dispatcher
 
 (
     HANDLE_CATEGORIES,
@@ -64,6 +104,13 @@ from common_users.services.bot_tools import (
     HANDLE_TECH_SUPPORT,
 ) = range(16)
 
+# conversation state names used in metrics
+STATE_NAMES = {
+    value: name
+    for name, value in list(globals().items())
+    if name.startswith("HANDLE_")
+}
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
@@ -72,6 +119,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 BACK_BUTTON = InlineKeyboardButton(text="Назад", callback_data="back")
+MAIN_MENU_BUTTON = InlineKeyboardButton(
+    text="Главное меню", callback_data="main_menu"
+)
 
 MAIN_MENU_BUTTONS = InlineKeyboardMarkup(
     [
@@ -140,6 +190,7 @@ async def get_chat_member(update, context):
         return True
 
 
+@query_budget(4)
 async def start(update, context):
     text = "Выберете действие:"
 
@@ -224,128 +275,80 @@ async def start(update, context):
 
 async def show_main_page(update, context):
     """show main page"""
-    context.user_data["current_page"] = 1
-
-    menu = await get_menu(context.user_data["current_page"])
-
-    await update.callback_query.answer()
-    await update.callback_query.edit_message_text(
-        text="Выберите парковочное место:", reply_markup=menu
-    )
+    await show_categories_page(update, context)
 
 
-async def show_next_page(update, context):
-    """show next page"""
-    context.user_data["current_page"] += 1
-    menu = await get_menu(context.user_data["current_page"])
+async def show_categories_page(update, context, cursor=None, direction=NEXT):
+    """show categories page"""
+    menu = await get_menu(cursor, direction)
     await update.callback_query.answer()
     await update.callback_query.edit_message_text(
         text="Выберите парковочное место:", reply_markup=menu
     )
 
 
-async def show_previous_page(update, context):
-    """show previous page"""
-    context.user_data["current_page"] -= 1
-    menu = await get_menu(context.user_data["current_page"])
-    await update.callback_query.answer()
-    await update.callback_query.edit_message_text(
-        text="Выберите парковочное место:", reply_markup=menu
-    )
-
-
-async def get_menu(current_page):
+async def get_menu(cursor=None, direction=NEXT):
     """get menu"""
 
-    categories_data = await get_categories(page_number=current_page)
+    categories_page = await get_categories(cursor, direction)
 
-    keyboard = [
-        InlineKeyboardButton(
+    return render_list_page(
+        categories_page,
+        text="Выберите парковочное место:",
+        item_button=lambda category: InlineKeyboardButton(
             text=category.name, callback_data=str(category.id)
-        )
-        for category in categories_data.get("categories")
-    ]
-
-    footer_buttons = []
-
-    if categories_data.get("has_previous"):
-        footer_buttons.insert(
-            0, InlineKeyboardButton(text="<<<", callback_data="prev")
-        )
-
-    if categories_data.get("has_next"):
-        footer_buttons.append(
-            InlineKeyboardButton(text=">>>", callback_data="next")
-        )
-
-    footer_buttons.append(
-        InlineKeyboardButton(text="Главное меню", callback_data="main_menu")
-    )
-
-    return InlineKeyboardMarkup(
-        build_menu(keyboard, n_cols=2, footer_buttons=footer_buttons)
-    )
+        ),
+        footer_buttons=[MAIN_MENU_BUTTON],
+        n_cols=2,
+    )["reply_markup"]
 
 
+@query_budget(2)
 async def handle_categories(update, context):
     """handle categories"""
 
     if update.callback_query.data in ("catalog", "back"):
         await show_main_page(update, context)
 
-    elif update.callback_query.data == "next":
-        await show_next_page(update, context)
-
-    elif update.callback_query.data == "prev":
-        await show_previous_page(update, context)
+    else:
+        direction, cursor = parse_page_callback(update.callback_query.data)
+        if cursor is not None:
+            await show_categories_page(update, context, cursor, direction)
 
     return HANDLE_PRODUCTS
 
 
+@query_budget(3)
 async def handle_products(update, context):
     """handle products"""
 
-    product_category = update.callback_query.data
-    products_category = await get_products(product_category)
+    direction, cursor = parse_page_callback(update.callback_query.data)
 
-    products_num = len(products_category)
+    if cursor is None:
+        context.user_data["category_id"] = update.callback_query.data
 
-    for product in products_category:
-        put_cart_button = InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        text="Выбрать", callback_data=str(product.id)
-                    )
-                ]
-            ]
-        )
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=get_product_detail(product),
-            reply_markup=put_cart_button,
-            parse_mode=ParseMode.HTML,
-        )
+    products_page = await get_products(
+        context.user_data["category_id"], cursor, direction
+    )
+    products_num = len(products_page["items"])
 
-    keyboard = [
-        [
-            BACK_BUTTON,
-            InlineKeyboardButton(
-                text="Главное меню", callback_data="main_menu"
+    await update.callback_query.answer()
+    await update.callback_query.edit_message_text(
+        **render_list_page(
+            products_page,
+            text=f"Показано парковочных мест: {products_num}",
+            item_button=lambda product: InlineKeyboardButton(
+                text=product.name, callback_data=str(product.id)
             ),
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await context.bot.send_message(
-        text=f"Показано парковочных мест: {products_num}",
-        chat_id=update.effective_chat.id,
-        reply_markup=reply_markup,
+            footer_buttons=[BACK_BUTTON, MAIN_MENU_BUTTON],
+            n_cols=2,
+        ),
+        parse_mode=ParseMode.HTML,
     )
     return HANDLE_DESCRIPTION
 
 
+@query_budget(1)
 async def handle_product_detail(update, context):
     """handle product detail"""
 
@@ -376,6 +379,7 @@ async def handle_product_detail(update, context):
     return HANDLE_CART
 
 
+@query_budget(1)
 async def check_quantity(update, context):
     """check quantity"""
 
@@ -397,6 +401,20 @@ async def check_quantity(update, context):
             )
             return HANDLE_CART
 
+        if not await is_product_free(
+            context.user_data["product_id"], int(quantity)
+        ):
+            await context.bot.send_message(
+                text=textwrap.dedent(
+                    """
+                <b>Место занято на это время, выберите меньше часов</b>
+                """
+                ),
+                chat_id=update.effective_chat.id,
+                parse_mode=ParseMode.HTML,
+            )
+            return HANDLE_CART
+
         reply_markup = InlineKeyboardMarkup(
             [
                 [
@@ -435,6 +453,7 @@ async def check_quantity(update, context):
         return HANDLE_CART
 
 
+@query_budget(2)
 async def update_car_number(update, context):
     """update car number"""
 
@@ -510,6 +529,7 @@ async def update_car_number(update, context):
         return HANDLE_REGISTER_CAR_NUMBER
 
 
+@query_budget(2)
 async def update_car_serial_number(update, context):
     """update car serial number"""
 
@@ -576,6 +596,7 @@ async def update_car_serial_number(update, context):
         return HANDLE_CATEGORIES
 
 
+@query_budget(2)
 async def update_car_number_region(update, context):
     """update car number region"""
 
@@ -649,6 +670,7 @@ async def update_car_number_region(update, context):
         return HANDLE_REGISTER_CAR_REGION
 
 
+@query_budget(2)
 async def update_user_phone(update, context):
     """update user phone"""
     phone = update.message.contact.phone_number
@@ -685,6 +707,7 @@ async def update_user_phone(update, context):
     return HANDLE_CATEGORIES
 
 
+@query_budget(3)
 async def add_cart(update, context):
     """add cart"""
     if update.callback_query.data == "cart":
@@ -702,11 +725,11 @@ async def add_cart(update, context):
 
         back = [BACK_BUTTON]
 
-        for position, product in enumerate(products, start=1):
+        for position, item in enumerate(products, start=1):
             keyboard.append(
                 InlineKeyboardButton(
                     text=f"Удалить позицию №{position}",
-                    callback_data=str(product.id),
+                    callback_data=item.product_id,
                 )
             )
         keyboard_groups = build_menu(keyboard, n_cols=2)
@@ -732,34 +755,27 @@ async def show_cart_info(update, context):
     await update.callback_query.edit_message_text(text=products)
 
 
+def get_took_place_button(purchase):
+    """returns "took place" button of a purchase"""
+    return InlineKeyboardButton(
+        text=f"Занял место: {purchase.product_name}",
+        callback_data=str(purchase.id),
+    )
+
+
+@query_budget(2)
 async def show_purchases_info(update, context):
     """show purchases info"""
     products = await get_user_products(context)
 
-    if len(products) == 0:
+    direction, cursor = parse_page_callback(update.callback_query.data)
+    purchases_page = await get_purchases(context, cursor, direction)
+
+    if not products and not purchases_page["items"]:
         await update.callback_query.answer("Брони отсутствуют")
         return
 
-    product_info = ""
-
-    purchases = await get_purchases(context)
-
-    for purchase in purchases:
-        purchase_button = InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        text="Занял место", callback_data=str(purchase.id)
-                    )
-                ]
-            ]
-        )
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=textwrap.dedent(f"<b>{purchase.product_name}</b>"),
-            reply_markup=purchase_button,
-            parse_mode=ParseMode.HTML,
-        )
+    product_info = "Нажмите на место, когда займете его:\n"
 
     for position, product in enumerate(products, start=1):
         product_info += textwrap.dedent(
@@ -770,16 +786,19 @@ async def show_purchases_info(update, context):
             """
         )
 
-    reply_markup = InlineKeyboardMarkup([[BACK_BUTTON]])
-
     await update.callback_query.edit_message_text(
-        text=product_info,
-        reply_markup=reply_markup,
+        **render_list_page(
+            purchases_page,
+            text=product_info,
+            item_button=get_took_place_button,
+            footer_buttons=[BACK_BUTTON],
+        ),
         parse_mode=ParseMode.HTML,
     )
     return HANDLE_TOOK_PLACE
 
 
+@query_budget(1)
 async def tech_support(update, context):
     """Техподдержка"""
 
@@ -808,19 +827,20 @@ async def tech_support(update, context):
     return HANDLE_TECH_SUPPORT
 
 
+@query_budget(1)
 async def handle_cart(update, context):
     """handle cart"""
-    if "cart" not in context.user_data:
+    if not context.user_data.get("cart"):
         await update.callback_query.answer("Пустая корзина")
         return
     else:
         products_info, products = await get_cart_products_info(context)
         keyboard = []
-        for position, product in enumerate(products, start=1):
+        for position, item in enumerate(products, start=1):
             keyboard.append(
                 InlineKeyboardButton(
                     text=f"Удалить позицию №{position}",
-                    callback_data=str(product.id),
+                    callback_data=item.product_id,
                 )
             )
         keyboard_groups = build_menu(keyboard, n_cols=2)
@@ -847,19 +867,36 @@ async def remove_product(update, context):
     return HANDLE_MENU
 
 
+@query_budget(6)
 async def handle_user_payment(update, context):
     """handle user payment"""
-    order_info = await get_product_info_for_payment(context)
-
     chat_id = update.effective_user.id
-    price = order_info["total_order_price"]
-    prices = [LabeledPrice("Оплата товаров", int(price) * 100)]
+    hold = await hold_cart_products(context)
+
+    if hold["conflicts"]:
+        conflicts = ", ".join(hold["conflicts"])
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"<b>Места уже забронированы другими:</b> {conflicts}",
+            reply_markup=(
+                None
+                if hold["payload"]
+                else InlineKeyboardMarkup([[MAIN_MENU_BUTTON]])
+            ),
+            parse_mode=ParseMode.HTML,
+        )
+
+    if hold["payload"] is None:
+        return HANDLE_CATEGORIES
+
+    order_info = await get_product_info_for_payment(context)
+    prices = [LabeledPrice("Оплата товаров", order_info["total_amount"])]
 
     await context.bot.send_invoice(
         chat_id=chat_id,
         title='Оплата услуг "iPark"',
         description=order_info["products_info"],
-        payload="telegram-store",
+        payload=hold["payload"],
         provider_token=settings.PAYMENT_TOKEN,
         currency="KZT",
         prices=prices,
@@ -867,70 +904,70 @@ async def handle_user_payment(update, context):
     return HANDLE_USER_REPLY
 
 
+@query_budget(3)
 async def pre_checkout_callback(update, context):
     """pre checkout callback"""
     query = update.pre_checkout_query
-    if query.invoice_payload != "telegram-store":
-        await query.answer(ok=False, error_message="Something went wrong...")
+    if not await extend_hold(context, query.invoice_payload):
+        await query.answer(
+            ok=False,
+            error_message="Бронь истекла, оформите заказ заново",
+        )
     else:
         await query.answer(ok=True)
     return HANDLE_USER_REPLY
 
 
+@query_budget(12)
 async def successful_payment_callback(update, context):
     """successful payment callback"""
 
-    if await create_purchase(context):
-        context.user_data["cart"] = None
+    support_text = "В случай возникновений проблем обратиться к тех. поддержку"
+
+    result = await create_purchase(
+        context, update.message.successful_payment.invoice_payload
+    )
+    # the booking funnel ends here
+    finish_conversation(context)
+
+    if result["conflicts"]:
+        conflicts = ", ".join(result["conflicts"])
+        support_text = (
+            f"<b>Места уже забронированы другими:</b> {conflicts}\n"
+            f"{support_text}"
+        )
 
+    if result["reserved"]:
         text = f"""
         <b>Бронь успешно поставлена</b>
         При занятии парковочного места необходимо нажать кнопку «занял место».
         Бронь держится {settings.START_MINUTE} минут, в случае если не 
         успеете уложиться в данное время, бронь снимается."""
 
-        await update.message.reply_text(
-            text=textwrap.dedent(text), parse_mode=ParseMode.HTML
-        )
-
-        purchases = await get_purchases(context)
-
-        for purchase in purchases:
-            purchase_button = InlineKeyboardMarkup(
-                [
-                    [
-                        InlineKeyboardButton(
-                            text="Занял место", callback_data=str(purchase.id)
-                        )
-                    ]
-                ]
-            )
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=textwrap.dedent(f"<b>{purchase.product_name}</b>"),
-                reply_markup=purchase_button,
-                parse_mode=ParseMode.HTML,
-            )
+        purchases_page = await get_purchases(context)
 
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                text="Главное меню", callback_data="main_menu"
+        await update.message.reply_text(
+            **render_list_page(
+                purchases_page,
+                text=textwrap.dedent(text) + f"\n\n{support_text}",
+                item_button=get_took_place_button,
+                footer_buttons=[MAIN_MENU_BUTTON],
             ),
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+            parse_mode=ParseMode.HTML,
+        )
 
-    await context.bot.send_message(
-        text="В случай возникновений проблем обратиться к тех. поддержку",
-        chat_id=update.effective_chat.id,
-        reply_markup=reply_markup,
-    )
+    else:
+        await update.message.reply_text(
+            text="<b>Оплата получена, но места не забронированы</b>\n"
+            f"{support_text}",
+            reply_markup=InlineKeyboardMarkup([[MAIN_MENU_BUTTON]]),
+            parse_mode=ParseMode.HTML,
+        )
 
     return HANDLE_TOOK_PLACE
 
 
+@query_budget(5)
 async def took_place(update, context):
     purchase_id = update.callback_query.data
     expiration_date = await complete_purchase(purchase_id)
@@ -954,10 +991,77 @@ async def took_place(update, context):
     return HANDLE_MENU
 
 
-async def handle_check_product_expiration_date(context):
-    await update_product_expiration_date()
+async def handle_maintenance_lease(context):
+    """
+    Renew maintenance lease and pick up deadlines of other instances.
+
+    A new leader loads every booked product once, later resyncs only read
+    the products changed since the previous one.
+    """
+    sync = context.job.data
+    if not await database_sync_to_async(maintenance_lease.acquire)():
+        sync["synced_at"] = None
+        return
+
+    now = timezone.now()
+    updated_after = sync["synced_at"]
+    if updated_after is not None:
+        updated_after -= timedelta(seconds=settings.EXPIRY_SYNC_OVERLAP)
+
+    pending = await get_pending_expirations(updated_after)
+    sync["synced_at"] = now
+
+    expiry_scheduler.load(pending)
+    reminder_scheduler.load(
+        (product_id, get_reminder_date(expiration_date))
+        for product_id, expiration_date in pending
+        if get_reminder_date(expiration_date) > now
+    )
 
 
+async def handle_expired_products(context, product_ids):
+    """handle expired products"""
+    if not maintenance_lease.is_leader:
+        # the leader releases them after its next deadlines resync
+        return
+
+    started = time.monotonic()
+    released = await release_expired_products(product_ids)
+    EXPIRY_JOB_SECONDS.observe(time.monotonic() - started)
+    EXPIRY_RELEASED.inc(len(released))
+    logger.info("Released %s expired products", len(released))
+
+    await notify_users(
+        context.bot,
+        group_by_user(
+            # unpaid holds were never announced as bookings
+            [product for product in released if not product["is_hold"]],
+            lambda product: f"Бронь на место <b>{product['name']}</b> снята",
+        ),
+    )
+
+
+async def handle_expiring_products(context, product_ids):
+    """remind lessors that their booking expires soon"""
+    if not maintenance_lease.is_leader:
+        return
+
+    products = await get_expiring_products(product_ids)
+    now = timezone.now()
+
+    def render(product):
+        minutes = max(
+            round((product["expiration_date"] - now).total_seconds() / 60), 1
+        )
+        return (
+            f"Бронь на место <b>{product['name']}</b> "
+            f"истекает через {minutes} мин."
+        )
+
+    await notify_users(context.bot, group_by_user(products, render))
+
+
+@query_budget(0)
 async def cancel(update, context):
     await update.message.reply_text(
         "Bye! I hope we can talk again some day.",
@@ -967,6 +1071,7 @@ async def cancel(update, context):
     return ConversationHandler.END
 
 
+@query_budget(1)
 async def handle_faq(update, context):
     """handle faq"""
     text = "<b>Часто задаваемые вопросы:</b>"
@@ -990,22 +1095,103 @@ async def handle_faq(update, context):
 
 
 async def handle_error(update, context):
+    HANDLER_ERRORS.inc(error=type(context.error).__name__)
     logger.error(context.error)
 
 
-def bot_starting():
-    """bot stat command"""
-    bot_token = settings.TELEGRAM_BOT_TOKEN
-    application = Application.builder().token(bot_token).build()
-
+async def post_init(application, metrics_port=None):
+    """post init"""
     if application.job_queue:
+        expiry_scheduler.start(
+            application.job_queue,
+            handle_expired_products,
+            delay=timedelta(seconds=settings.EXPIRY_CLEANUP_DELAY),
+        )
+        reminder_scheduler.start(
+            application.job_queue, handle_expiring_products
+        )
         application.job_queue.run_repeating(
-            handle_check_product_expiration_date, interval=60, first=10
+            handle_maintenance_lease,
+            interval=settings.JOB_LEASE_TTL / 3,
+            first=0,
+            data={"synced_at": None},
         )
 
+    if metrics_port is None:
+        metrics_port = settings.BOT_METRICS_PORT
+
+    if metrics_port:
+        # the update queue is drained at once, updates wait in the per-user
+        # queues instead
+        UPDATE_QUEUE_DEPTH.function = lambda: application.queue_stats()[
+            "waiting"
+        ]
+        USER_QUEUE_UPDATES.function = lambda: application.queue_stats()[
+            "updates"
+        ]
+        OUTBOUND_QUEUE_DEPTH.function = (
+            lambda: application.bot.rate_limiter.queue_stats()["waiting"]
+        )
+        await metrics_server.start(settings.BOT_METRICS_HOST, metrics_port)
+
+
+async def post_shutdown(application):
+    """post shutdown"""
+    await metrics_server.stop()
+    tracer.shutdown()
+    await database_sync_to_async(maintenance_lease.release)()
+
+
+def build_application(
+    webhook=False, base_url=None, maintenance=True, metrics_port=None
+):
+    """
+    build bot application
+
+    In webhook mode there is no updater, updates are put into
+    ``application.update_queue`` by the webhook view. ``base_url`` points
+    the bot at another Bot API server, e.g. the fake one of load tests.
+    Without ``maintenance`` there is no job queue, so post_init starts no
+    expiry schedulers and no lease loop. ``metrics_port`` replaces
+    ``settings.BOT_METRICS_PORT`` for processes sharing a host, 0 serves
+    no metrics.
+    """
+    bot_token = settings.TELEGRAM_BOT_TOKEN
+    builder = (
+        Application.builder()
+        .token(bot_token)
+        .application_class(UserOrderedApplication)
+        .concurrent_updates(settings.BOT_PENDING_UPDATES)
+        .post_init(functools.partial(post_init, metrics_port=metrics_port))
+        .post_shutdown(post_shutdown)
+        .rate_limiter(get_rate_limiter())
+        .persistence(
+            DjangoPersistence(
+                update_interval=settings.BOT_PERSISTENCE_INTERVAL
+            )
+        )
+    )
+
+    if webhook:
+        builder = builder.updater(None)
+
+    if not maintenance:
+        builder = builder.job_queue(None)
+
+    if base_url:
+        # the local fake server only speaks HTTP/1.1
+        builder = (
+            builder.base_url(base_url)
+            .http_version("1.1")
+            .get_updates_http_version("1.1")
+        )
+
+    application = builder.build()
+
     uuid_pattern = settings.BASE_PATTERN
+    page_pattern = settings.PAGE_PATTERN
 
-    conv_handler = ConversationHandler(
+    conv_handler = ReloadableConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             HANDLE_MENU: [
@@ -1034,6 +1220,7 @@ def bot_starting():
                 CallbackQueryHandler(
                     handle_product_detail, pattern=uuid_pattern
                 ),
+                CallbackQueryHandler(handle_products, pattern=page_pattern),
                 CallbackQueryHandler(handle_categories, pattern=r"back"),
                 CallbackQueryHandler(start, pattern=r"main_menu"),
             ],
@@ -1065,6 +1252,9 @@ def bot_starting():
             ],
             HANDLE_TOOK_PLACE: [
                 CallbackQueryHandler(took_place, pattern=uuid_pattern),
+                CallbackQueryHandler(
+                    show_purchases_info, pattern=page_pattern
+                ),
                 CallbackQueryHandler(start, pattern=r"back"),
                 CallbackQueryHandler(start, pattern=r"main_menu"),
             ],
@@ -1083,10 +1273,19 @@ def bot_starting():
         ],
         per_chat=False,
         allow_reentry=True,
+        name="conv_handler",
+        persistent=True,
     )
 
-    application.add_handler(conv_handler)
+    application.add_handler(instrument_conversation(conv_handler, STATE_NAMES))
+    application.add_error_handler(handle_error)
+
+    return application
 
+
+def bot_starting():
+    """bot stat command"""
+    application = build_application()
     application.run_polling()
 
 
@@ -1095,5 +1294,22 @@ class Command(BaseCommand):
 
     help = "Telegram bot"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Shard updates by user across this many worker processes",
+        )
+
     def handle(self, *args, **options):
-        bot_starting()
+        if settings.TELEGRAM_WEBHOOK_ENABLED:
+            raise CommandError(
+                "Webhook mode is enabled, the bot runs inside the ASGI app"
+            )
+
+        if options["workers"]:
+            dispatcher = Dispatcher(options["workers"])
+            asyncio.run(dispatcher.run())
+        else:
+            bot_starting()
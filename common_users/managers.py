@@ -1,8 +1,9 @@
 from django.contrib.auth.base_user import BaseUserManager
 from common_users.constants import UserType
+from core.models.managers import SoftDeleteManager
 
 
-class UserManager(BaseUserManager):
+class UserManager(BaseUserManager, SoftDeleteManager):
     """UserManager"""
 
     use_in_migrations = True
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common_users", "0006_commonuserpurchase_is_completed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelegramUpdate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, db_index=True),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("is_deleted", models.BooleanField(default=False)),
+                (
+                    "update_id",
+                    models.BigIntegerField(
+                        unique=True, verbose_name="Update id"
+                    ),
+                ),
+                (
+                    "telegram_user_id",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="Telegram user id"
+                    ),
+                ),
+                ("payload", models.JSONField(verbose_name="Payload")),
+                (
+                    "is_processed",
+                    models.BooleanField(
+                        default=False, verbose_name="Is processed"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Telegram update",
+                "verbose_name_plural": "Telegram updates",
+                "db_table": "telegram_updates",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("is_processed", False)),
+                        fields=["update_id"],
+                        name="telegram_updates_pending_idx",
+                    )
+                ],
+            },
+        ),
+    ]
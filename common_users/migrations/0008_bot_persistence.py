@@ -0,0 +1,76 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common_users", "0007_telegram_update"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BotUserData",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, db_index=True),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("is_deleted", models.BooleanField(default=False)),
+                (
+                    "telegram_user_id",
+                    models.BigIntegerField(
+                        unique=True, verbose_name="Telegram user id"
+                    ),
+                ),
+                ("data", models.BinaryField(verbose_name="Data")),
+            ],
+            options={
+                "verbose_name": "Bot user data",
+                "verbose_name_plural": "Bot user data",
+                "db_table": "bot_user_data",
+            },
+        ),
+        migrations.CreateModel(
+            name="BotConversation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, db_index=True),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("is_deleted", models.BooleanField(default=False)),
+                ("name", models.CharField(max_length=50, verbose_name="Name")),
+                ("key", models.CharField(max_length=100, verbose_name="Key")),
+                (
+                    "state",
+                    models.IntegerField(null=True, verbose_name="State"),
+                ),
+            ],
+            options={
+                "verbose_name": "Bot conversation",
+                "verbose_name_plural": "Bot conversations",
+                "db_table": "bot_conversations",
+                "unique_together": {("name", "key")},
+            },
+        ),
+    ]
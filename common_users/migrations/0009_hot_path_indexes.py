@@ -0,0 +1,20 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common_users", "0008_bot_persistence"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="commonuserpurchase",
+            index=models.Index(
+                condition=models.Q(("is_completed", False)),
+                fields=["user", "created"],
+                name="common_user_purchases_open_idx",
+            ),
+        ),
+    ]
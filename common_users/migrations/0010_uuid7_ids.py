@@ -0,0 +1,52 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:39
+
+import core.models.base
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common_users", "0009_hot_path_indexes"),
+    ]
+
+    operations = [
+        # the default is applied by Django, existing random keys are kept
+        # and no table is rewritten
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="commonuser",
+                    name="id",
+                    field=models.UUIDField(
+                        default=core.models.base.generate_uuid,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="commonuserpurchase",
+                    name="id",
+                    field=models.UUIDField(
+                        default=core.models.base.generate_uuid,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="faq",
+                    name="id",
+                    field=models.UUIDField(
+                        default=core.models.base.generate_uuid,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common_users", "0010_uuid7_ids"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="commonuserpurchase",
+            name="common_user_purchases_open_idx",
+        ),
+        migrations.AddIndex(
+            model_name="commonuser",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False)),
+                fields=["user_type"],
+                name="common_users_live_type_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="commonuserpurchase",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_completed", False), ("is_deleted", False)
+                ),
+                fields=["user", "created"],
+                name="common_user_purchases_open_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="faq",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False)),
+                fields=["created"],
+                name="faqs_live_idx",
+            ),
+        ),
+    ]
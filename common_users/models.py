@@ -5,7 +5,7 @@ from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from phonenumber_field.modelfields import PhoneNumberField
 
 from common_users.managers import UserManager
-from core.models.base import BaseUUIDModel
+from core.models.base import BaseModel, BaseUUIDModel
 
 from common_users.constants import (
     UserType,
@@ -64,6 +64,13 @@ class CommonUser(AbstractBaseUser, PermissionsMixin, BaseUUIDModel):
         verbose_name_plural = _("CommonUsers")
         db_table = "common_users"
         unique_together = ["phone", "user_type"]
+        indexes = [
+            models.Index(
+                fields=["user_type"],
+                name="common_users_live_type_idx",
+                condition=models.Q(is_deleted=False),
+            ),
+        ]
 
     @property
     def full_name(self):
@@ -80,6 +87,13 @@ class FAQ(BaseUUIDModel):
         verbose_name = "FAQ"
         verbose_name_plural = "FAQ"
         db_table = "faqs"
+        indexes = [
+            models.Index(
+                fields=["created"],
+                name="faqs_live_idx",
+                condition=models.Q(is_deleted=False),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.question}"
@@ -110,3 +124,65 @@ class CommonUserPurchase(BaseUUIDModel):
         verbose_name = "CommonUser purchase"
         verbose_name_plural = "CommonUser purchases"
         db_table = "common_user_purchases"
+        indexes = [
+            models.Index(
+                fields=["user", "created"],
+                name="common_user_purchases_open_idx",
+                condition=models.Q(is_completed=False, is_deleted=False),
+            ),
+        ]
+
+
+class TelegramUpdate(BaseModel):
+    """TelegramUpdate"""
+
+    update_id = models.BigIntegerField(
+        verbose_name=_("Update id"), unique=True
+    )
+    telegram_user_id = models.BigIntegerField(
+        verbose_name=_("Telegram user id"), null=True, blank=True
+    )
+    payload = models.JSONField(verbose_name=_("Payload"))
+    is_processed = models.BooleanField(
+        verbose_name=_("Is processed"), default=False
+    )
+
+    class Meta:
+        verbose_name = "Telegram update"
+        verbose_name_plural = "Telegram updates"
+        db_table = "telegram_updates"
+        indexes = [
+            models.Index(
+                fields=["update_id"],
+                name="telegram_updates_pending_idx",
+                condition=models.Q(is_processed=False),
+            ),
+        ]
+
+
+class BotUserData(BaseModel):
+    """BotUserData"""
+
+    telegram_user_id = models.BigIntegerField(
+        verbose_name=_("Telegram user id"), unique=True
+    )
+    data = models.BinaryField(verbose_name=_("Data"))
+
+    class Meta:
+        verbose_name = "Bot user data"
+        verbose_name_plural = "Bot user data"
+        db_table = "bot_user_data"
+
+
+class BotConversation(BaseModel):
+    """BotConversation"""
+
+    name = models.CharField(verbose_name=_("Name"), max_length=50)
+    key = models.CharField(verbose_name=_("Key"), max_length=100)
+    state = models.IntegerField(verbose_name=_("State"), null=True)
+
+    class Meta:
+        verbose_name = "Bot conversation"
+        verbose_name_plural = "Bot conversations"
+        db_table = "bot_conversations"
+        unique_together = ["name", "key"]
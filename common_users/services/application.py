@@ -0,0 +1,98 @@
+import asyncio
+
+from django.conf import settings
+from telegram import Update
+from telegram.ext import Application, ConversationHandler
+
+
+class UserOrderedApplication(Application):
+    """
+    Application processing different users concurrently.
+
+    PTB's ``concurrent_updates`` runs every update as its own task, which
+    would let two updates of one user race through the ConversationHandler
+    and the cart. Here each user has a FIFO lock, so updates of one user are
+    processed strictly in arrival order, and at most
+    ``settings.BOT_CONCURRENT_UPDATES`` users are processed at a time.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # user id -> [lock, updates waiting or in progress]
+        self._user_queues = {}
+        # updates holding a processing slot
+        self._active = 0
+        self._processing = asyncio.BoundedSemaphore(
+            settings.BOT_CONCURRENT_UPDATES
+        )
+
+    async def process_update(self, update):
+        user_id = None
+        if isinstance(update, Update) and update.effective_user:
+            user_id = update.effective_user.id
+
+        if user_id is None:
+            async with self._processing:
+                return await super().process_update(update)
+
+        queue = self._user_queues.setdefault(user_id, [asyncio.Lock(), 0])
+        queue[1] += 1
+        try:
+            # tasks are created in arrival order and asyncio locks are fair,
+            # so the lock hands the user's updates out in the same order
+            async with queue[0]:
+                async with self._processing:
+                    self._active += 1
+                    try:
+                        await super().process_update(update)
+                    finally:
+                        self._active -= 1
+        finally:
+            queue[1] -= 1
+            if not queue[1]:
+                del self._user_queues[user_id]
+
+    def queue_stats(self):
+        """returns per-user queue metrics"""
+        sizes = [queue[1] for queue in self._user_queues.values()]
+        return {
+            "users": len(sizes),
+            "updates": sum(sizes),
+            "waiting": max(sum(sizes) - self._active, 0),
+            "max_user_updates": max(sizes, default=0),
+        }
+
+
+class ReloadableConversationHandler(ConversationHandler):
+    """
+    ConversationHandler whose cached state of one key can be replaced,
+    e.g. when a user moves to another worker process.
+    """
+
+    def reload_state(self, key, state):
+        """replace the cached state of ``key``, None ends the conversation"""
+        if state is None:
+            # untracked, the persisted state is already the current one
+            self._conversations.data.pop(key, None)
+        else:
+            self._conversations.update_no_track({key: state})
+
+    def reload_states(self, states):
+        """replace all cached states with ``states``, {key: state}"""
+        self._conversations.data.clear()
+        self._conversations.update_no_track(states)
+
+
+async def reload_all_conversations(application):
+    """replace cached conversation states of all users with persisted ones"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if (
+                isinstance(handler, ReloadableConversationHandler)
+                and handler.persistent
+            ):
+                handler.reload_states(
+                    await application.persistence.get_conversations(
+                        handler.name
+                    )
+                )
@@ -1,30 +1,50 @@
+import logging
+import secrets
 import textwrap as tw
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 
-from asgiref.sync import sync_to_async
-from django.db.models import Count, F
+from django.db.models import F
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 from common_users.constants import UserType
 from common_users.models import CommonUser, FAQ, CommonUserPurchase
-from common_users.services.cart import Cart
+from common_users.services.cart import Cart, CartItem, to_major, to_minor
+from common_users.services.catalog import catalog_cache
+from common_users.services.pagination import (
+    NEXT,
+    PREV,
+    page_callback,
+    paginate_queryset,
+)
+from common_users.services.db import database_sync_to_async
+from common_users.services.expiry_scheduler import (
+    expiry_scheduler,
+    reminder_scheduler,
+)
 
-from orders.models import Category, Product
+from orders.intervals import reservation_index
+from orders.models import Category, Product, Reservation
 
+logger = logging.getLogger(__name__)
 
-@sync_to_async
+HOLD_PAYLOAD_PREFIX = "hold"
+
+
+@database_sync_to_async
 def get_user(context):
     telegram_user_id = context.user_data["telegram_user_id"]
     user = CommonUser.objects.get(telegram_user_id=telegram_user_id)
     return user
 
 
-@sync_to_async
+@database_sync_to_async
 def create_user(telegram_user_id, first_name, last_name, username):
-    """create user"""
-    user, created = CommonUser.objects.get_or_create(
+    """create user, a soft deleted one is restored"""
+    user, created = CommonUser.all_objects.get_or_create(
         telegram_user_id=telegram_user_id,
         username=username,
         defaults={
@@ -33,10 +53,13 @@ def create_user(telegram_user_id, first_name, last_name, username):
             "username": username,
         },
     )
+    if user.is_deleted:
+        CommonUser.all_objects.filter(pk=user.pk).restore()
+        user.is_deleted = False
     return user
 
 
-@sync_to_async
+@database_sync_to_async
 def update_user_car(telegram_user_id, update_dict):
     """update user car"""
     CommonUser.objects.filter(
@@ -50,50 +73,53 @@ def update_user_car(telegram_user_id, update_dict):
     return user
 
 
-@sync_to_async
-def get_categories(page_number):
-    """returns category paginate objects"""
-
-    categories = (
-        Category.objects.filter(
-            is_active=True,
-        )
-        .annotate(product_count=Count(F("products")))
-        .filter(product_count__gt=0)
-        .order_by("name")
+@database_sync_to_async
+def get_categories(cursor=None, direction=NEXT):
+    """returns categories page"""
+    return catalog_cache.get_categories(
+        cursor, direction, per_page=settings.BASE_PAGINATE_BY
     )
 
-    paginator = Paginator(
-        object_list=categories, per_page=settings.BASE_PAGINATE_BY
-    )
-
-    page_obj = paginator.get_page(page_number)
-
-    categories_list = [x for x in page_obj]
 
-    return_data = {
-        "categories": categories_list,
-        "has_previous": page_obj.has_previous(),
-        "has_next": page_obj.has_next(),
-    }
-
-    return return_data
-
-
-@sync_to_async
+@database_sync_to_async
 def get_category(category_id):
     """get category"""
     category = Category.objects.get(id=category_id)
     return category
 
 
-@sync_to_async
-def get_products(category_id):
-    """returns products list"""
-    products = Product.objects.select_related("category").filter(
-        category=category_id, is_free=True
+@database_sync_to_async
+def get_products(category_id, cursor=None, direction=NEXT):
+    """returns page of products free for at least the shortest booking"""
+    now = timezone.now()
+    busy = Reservation.objects.busy_product_ids(
+        category_id, now, get_booking_end(now, 1)
+    )
+    return catalog_cache.get_products(
+        category_id,
+        cursor,
+        direction,
+        per_page=settings.LIST_PAGINATE_BY,
+        busy=busy,
+    )
+
+
+def get_booking_end(start, quantity):
+    """returns latest end of a booking of ``quantity`` hours"""
+    return start + timedelta(
+        minutes=settings.START_MINUTE + settings.END_MINUTE, hours=quantity
+    )
+
+
+@database_sync_to_async
+def is_product_free(product_id, quantity):
+    """check that product has no reservation for ``quantity`` hours"""
+    now = timezone.now()
+    return (
+        not Reservation.objects.filter(product_id=product_id, start__gt=now)
+        .overlapping(now, get_booking_end(now, quantity))
+        .exists()
     )
-    return [product for product in products]
 
 
 def get_product_detail(product):
@@ -101,14 +127,14 @@ def get_product_detail(product):
     return tw.dedent(f"<b>{product.name}</b>")
 
 
-@sync_to_async
+@database_sync_to_async
 def get_product_name(product_id):
     """returns product name"""
     product = Product.objects.get(id=product_id)
     return tw.dedent(f"<b>{product.name}</b>")
 
 
-@sync_to_async
+@database_sync_to_async
 def add_product_to_cart(context):
     """add product to card"""
     product_id = context.user_data["product_id"]
@@ -123,13 +149,12 @@ def add_product_to_cart(context):
     )
 
 
-@sync_to_async
+@database_sync_to_async
 def remove_product_from_cart(context):
     """remove product from cart"""
     product_id = context.user_data["product_id"]
-    product = Product.objects.get(id=product_id)
     cart = Cart(context)
-    cart.remove(product)
+    cart.remove(product_id)
 
 
 def get_cart_info(context):
@@ -138,21 +163,21 @@ def get_cart_info(context):
     return cart
 
 
-@sync_to_async
+@database_sync_to_async
 def get_cart_products_info(context):
     """get cart products info"""
 
     cart = Cart(context)
+    cart.refresh()
     products = []
     products_info = ""
 
-    for position, product in enumerate(cart, start=1):
-        products.append(product["product"])
-        raw_name = product["product"]
-        name = raw_name.name
-        quantity = product["quantity"]
-        price = product["price"]
-        product_total_price = product["total_price"]
+    for position, item in enumerate(cart, start=1):
+        products.append(item)
+        name = item.name
+        quantity = item.quantity
+        price = to_major(item.price)
+        product_total_price = to_major(item.total_price)
         products_info += tw.dedent(
             f"""
         №{position}. 
@@ -170,17 +195,17 @@ def get_cart_products_info(context):
     return products_info, products
 
 
-@sync_to_async
+@database_sync_to_async
 def get_product_info_for_payment(context):
     """get product info for payment"""
     products_in_cart = get_cart_info(context)
+    products_in_cart.refresh()
     total_order_price = products_in_cart.get_total_price()
     products_info = ""
 
-    for product in products_in_cart:
-        raw_name = product["product"]
-        name = raw_name.name
-        quantity = product["quantity"]
+    for item in products_in_cart:
+        name = item.name
+        quantity = item.quantity
         products_info += tw.dedent(
             f"""
         {name}
@@ -195,58 +220,258 @@ def get_product_info_for_payment(context):
     return {
         "products_info": products_info,
         "total_order_price": total_order_price,
+        "total_amount": products_in_cart.get_total_amount(),
     }
 
 
-@sync_to_async
-def create_purchase(context):
-    """create order"""
+def make_hold_payload(hold_token, count):
+    """returns invoice payload of held products"""
+    return f"{HOLD_PAYLOAD_PREFIX}:{hold_token}:{count}"
+
+
+def parse_hold_payload(payload):
+    """returns (hold token, count) of an invoice payload, or (None, 0)"""
+    prefix, _, rest = payload.partition(":")
+    hold_token, _, count = rest.partition(":")
+
+    if prefix != HOLD_PAYLOAD_PREFIX or not hold_token or not count.isdigit():
+        return None, 0
+    return hold_token, int(count)
+
+
+@database_sync_to_async
+def hold_cart_products(context):
+    """
+    Hold cart products for the payment, products someone else took are
+    removed from the cart. Returns invoice payload (None when nothing was
+    held) and names of the removed products.
+    """
     cart = Cart(context)
     telegram_user_id = context.user_data["telegram_user_id"]
     user = CommonUser.objects.get(telegram_user_id=telegram_user_id)
-
-    purchase_elements = []
-    update_product = []
-
-    for order_product in cart:
-        product = order_product["product"]
-        quantity = order_product["quantity"]
-        purchase = CommonUserPurchase(
-            user=user,
-            product=product,
-            quantity=quantity,
-            amount=order_product["total_price"],
+    items = {item.product_id: item for item in cart}
+    hold_token = secrets.token_hex(16)
+    now = timezone.now()
+    hold_until = now + timedelta(seconds=settings.PAYMENT_HOLD_TTL)
+
+    held = {
+        str(product_id)
+        for product_id in Product.objects.reserve(
+            items,
+            lessor=user,
+            expiration_date=hold_until,
+            hold_token=hold_token,
         )
+    }
+    catalog_cache.invalidate()
+
+    conflicts = []
+    for product_id, item in items.items():
+        if product_id in held:
+            # reclaimed by the expiry scheduler unless paid in time
+            expiry_scheduler.schedule(product_id, hold_until)
+        else:
+            conflicts.append(item.name)
+            cart.remove(product_id)
+
+    # the invoice books the items held now, whatever the cart holds later
+    holds = {
+        token: hold
+        for token, hold in context.user_data.get(
+            settings.HOLDS_SESSION_ID, {}
+        ).items()
+        if hold["until"] > now
+    }
+    if held:
+        holds[hold_token] = {
+            "until": hold_until,
+            "items": {product_id: items[product_id] for product_id in held},
+        }
+    context.user_data[settings.HOLDS_SESSION_ID] = holds
 
-        product.is_free = False
-        product.lessor = user
-        product.expiration_date = datetime.now() + timedelta(
-            minutes=settings.START_MINUTE
-        )
+    return {
+        "payload": make_hold_payload(hold_token, len(held)) if held else None,
+        "conflicts": conflicts,
+    }
 
-        update_product.append(product)
-        purchase_elements.append(purchase)
 
-    CommonUserPurchase.objects.bulk_create(purchase_elements)
-    Product.objects.bulk_update(
-        update_product, ["is_free", "lessor", "expiration_date"]
-    )
+@database_sync_to_async
+def extend_hold(context, payload):
+    """
+    Extend the hold of the invoice products so it can not lapse while the
+    payment is processed, returns False when some of them were lost
+    """
+    hold_token, count = parse_hold_payload(payload)
+
+    if hold_token is None:
+        return False
+
+    hold_until = timezone.now() + timedelta(seconds=settings.PAYMENT_HOLD_TTL)
+    held = Product.objects.extend_hold(hold_token, count, hold_until)
+
+    if not held:
+        return False
+
+    hold = context.user_data.get(settings.HOLDS_SESSION_ID, {}).get(hold_token)
+    if hold is not None:
+        hold["until"] = hold_until
+    for product_id in held:
+        expiry_scheduler.schedule(product_id, hold_until)
     return True
 
 
-@sync_to_async
-def get_purchases(context):
-    """returns purchases"""
+def get_held_items(cart, hold_token, user):
+    """
+    returns cart items of the products held for ``user`` under
+    ``hold_token``, for a paid hold missing from the user data
+    """
+    items = {}
+
+    for product_id, name in Product.objects.filter(
+        hold_token=hold_token, lessor=user
+    ).values_list("id", "name"):
+        product_id = str(product_id)
+        items[product_id] = cart.cart.get(product_id) or CartItem(
+            product_id=product_id,
+            name=name,
+            version=0,
+            quantity=1,
+            price=to_minor(settings.BASE_PRICE),
+        )
+    return items
+
+
+@database_sync_to_async
+def create_purchase(context, payload):
+    """
+    Book the products held for the paid invoice, returns names of the
+    booked products and of those someone else booked first
+    """
+    hold_token, _ = parse_hold_payload(payload)
+    hold = context.user_data.get(settings.HOLDS_SESSION_ID, {}).pop(
+        hold_token, None
+    )
     telegram_user_id = context.user_data["telegram_user_id"]
-    purchases = CommonUserPurchase.objects.filter(
+    user = CommonUser.objects.get(telegram_user_id=telegram_user_id)
+    cart = Cart(context)
+
+    if hold is not None:
+        items = hold["items"]
+    elif hold_token is not None:
+        logger.warning("Hold %s is not in the user data", hold_token)
+        items = get_held_items(cart, hold_token, user)
+    else:
+        items = {}
+
+    for product_id in items:
+        cart.remove(product_id)
+
+    now = timezone.now()
+    expiration_date = now + timedelta(minutes=settings.START_MINUTE)
+    ends = {
+        product_id: get_booking_end(now, item.quantity)
+        for product_id, item in items.items()
+    }
+
+    # spots with a later reservation inside the booked hours, the current
+    # booking of a spot is checked by the conditional update
+    busy = {
+        str(product_id)
+        for product_id, start in Reservation.objects.filter(
+            product_id__in=list(items), start__gt=now
+        )
+        .overlapping(now, max(ends.values(), default=now))
+        .values_list("product_id", "start")
+        if start < ends[str(product_id)]
+    }
+
+    try:
+        with transaction.atomic():
+            reserved = {
+                str(product_id)
+                for product_id in Product.objects.reserve(
+                    [
+                        product_id
+                        for product_id in items
+                        if product_id not in busy
+                    ],
+                    lessor=user,
+                    expiration_date=expiration_date,
+                    held_with=hold_token,
+                )
+            }
+            # an expired booking may not be released yet
+            Reservation.objects.release(reserved, now)
+            CommonUserPurchase.objects.bulk_create(
+                [
+                    CommonUserPurchase(
+                        user=user,
+                        product_id=product_id,
+                        quantity=items[product_id].quantity,
+                        amount=to_major(items[product_id].total_price),
+                    )
+                    for product_id in reserved
+                ]
+            )
+            Reservation.objects.bulk_create(
+                [
+                    Reservation(
+                        product_id=product_id,
+                        lessor=user,
+                        start=now,
+                        end=ends[product_id],
+                    )
+                    for product_id in reserved
+                ]
+            )
+    except IntegrityError:
+        # a reservation made meanwhile overlaps, nothing was booked
+        reserved = set()
+
+    reservation_index.invalidate()
+    # the conditional update sends no post_save
+    catalog_cache.invalidate()
+
+    for product_id in reserved:
+        expiry_scheduler.schedule(product_id, expiration_date)
+        reminder_scheduler.schedule(
+            product_id, get_reminder_date(expiration_date)
+        )
+
+    return {
+        "reserved": [items[product_id].name for product_id in reserved],
+        "conflicts": [
+            item.name
+            for product_id, item in items.items()
+            if product_id not in reserved
+        ],
+    }
+
+
+def get_purchases_queryset(telegram_user_id):
+    """returns uncompleted purchases of user"""
+    return CommonUserPurchase.objects.filter(
         user__telegram_user_id=telegram_user_id,
         is_completed=False,
     ).annotate(product_name=F("product__name"))
 
-    return [purchase for purchase in purchases]
+
+@database_sync_to_async
+def get_purchases(context, cursor=None, direction=NEXT):
+    """returns purchases page"""
+    telegram_user_id = context.user_data["telegram_user_id"]
+    purchases = get_purchases_queryset(telegram_user_id)
+
+    return paginate_queryset(
+        purchases,
+        "product__name",
+        cursor,
+        direction,
+        per_page=settings.LIST_PAGINATE_BY,
+    )
 
 
-@sync_to_async
+@database_sync_to_async
 def get_admins():
     """returns admins"""
     admins = CommonUser.objects.filter(
@@ -256,48 +481,115 @@ def get_admins():
     return [admin for admin in admins]
 
 
-@sync_to_async
+def get_user_products_queryset(telegram_user_id):
+    """returns booked products the user arrived at"""
+    return Product.objects.booked().filter(
+        lessor__telegram_user_id=telegram_user_id, is_took_place=True
+    )
+
+
+@database_sync_to_async
 def get_user_products(context):
     """returns user products"""
     telegram_user_id = context.user_data["telegram_user_id"]
-    products = Product.objects.filter(
-        lessor__telegram_user_id=telegram_user_id, is_took_place=True
-    )
+    products = get_user_products_queryset(telegram_user_id)
 
     return [product for product in products]
 
 
-@sync_to_async
+@database_sync_to_async
 def complete_purchase(purchase_id):
     """complete purchase"""
-    purchase = CommonUserPurchase.objects.get(id=purchase_id)
+    purchase = CommonUserPurchase.objects.select_related("product").get(
+        id=purchase_id
+    )
 
     product = purchase.product
 
-    product.expiration_date = datetime.now() + timedelta(
+    product.expiration_date = timezone.now() + timedelta(
         hours=purchase.quantity
     )
     product.expiration_date += timedelta(minutes=settings.END_MINUTE)
     product.is_took_place = True
-    product.save()
+    product.save(update_fields=["expiration_date", "is_took_place", "updated"])
+
+    # the reservation was made for the latest possible arrival
+    Reservation.objects.filter(
+        product=product,
+        lessor=purchase.user,
+        start__lte=timezone.now(),
+        end__gt=product.expiration_date,
+    ).update(end=product.expiration_date)
+    reservation_index.invalidate()
+
+    expiry_scheduler.schedule(product.id, product.expiration_date)
+    reminder_scheduler.schedule(
+        product.id, get_reminder_date(product.expiration_date)
+    )
 
     purchase.is_completed = True
-    purchase.save()
+    purchase.save(update_fields=["is_completed", "updated"])
 
-    expiration_date = product.expiration_date - timedelta(
-        minutes=settings.END_MINUTE
-    )
-    return expiration_date.strftime("%d %B %Y, %H:%M:%S")
+    return product.str_expiration_date
 
 
-@sync_to_async
-def update_product_expiration_date():
-    Product.objects.filter(
-        is_free=False, lessor__isnull=False, expiration_date__lt=datetime.now()
-    ).update(is_free=True, lessor=None, expiration_date=None)
+def get_pending_expirations_queryset(updated_after=None):
+    """
+    returns (product id, expiration date) pairs of booked products, only
+    those changed after ``updated_after`` when it is given
+    """
+    queryset = Product.objects.filter(
+        is_free=False, expiration_date__isnull=False
+    )
+    if updated_after is not None:
+        queryset = queryset.filter(updated__gt=updated_after)
+    return queryset.values_list("id", "expiration_date")
+
+
+@database_sync_to_async
+def get_pending_expirations(updated_after=None):
+    """returns (product id, expiration date) pairs of booked products"""
+    return list(get_pending_expirations_queryset(updated_after))
+
+
+def get_reminder_date(expiration_date):
+    """returns date of the "booking expires soon" reminder"""
+    return expiration_date - timedelta(minutes=settings.END_MINUTE)
+
+
+@database_sync_to_async
+def release_expired_products(product_ids):
+    """release expired products, returns them with their former lessors"""
+    released = Product.objects.release_expired(product_ids)
+    if released:
+        Reservation.objects.release([product["id"] for product in released])
+        catalog_cache.invalidate()
+        reservation_index.invalidate()
+    return released
+
+
+@database_sync_to_async
+def get_expiring_products(product_ids):
+    """returns booked products whose reminder is due"""
+    reminder_limit = timezone.now() + timedelta(minutes=settings.END_MINUTE)
+    return list(
+        Product.objects.booked()
+        .filter(
+            id__in=product_ids,
+            lessor__isnull=False,
+            hold_token__isnull=True,
+            expiration_date__lte=reminder_limit,
+        )
+        .values(
+            "id",
+            "name",
+            "expiration_date",
+            telegram_user_id=F("lessor__telegram_user_id"),
+        )
+    )
 
 
-@sync_to_async
+@database_sync_to_async
 def get_text_faq():
     all_faq = FAQ.objects.all()
     text_faq = ""
@@ -322,3 +614,49 @@ def build_menu(buttons, n_cols, header_buttons=None, footer_buttons=None):
     if footer_buttons:
         menu.append(footer_buttons)
     return menu
+
+
+def get_page_buttons(page):
+    """returns previous/next page buttons of a keyset page"""
+    buttons = []
+
+    if not page["items"]:
+        return buttons
+
+    if page["has_previous"]:
+        buttons.append(
+            InlineKeyboardButton(
+                text="<<<", callback_data=page_callback(PREV, page["items"][0])
+            )
+        )
+
+    if page["has_next"]:
+        buttons.append(
+            InlineKeyboardButton(
+                text=">>>",
+                callback_data=page_callback(NEXT, page["items"][-1]),
+            )
+        )
+
+    return buttons
+
+
+def render_list_page(page, text, item_button, footer_buttons=(), n_cols=1):
+    """
+    Render a keyset page as a single message.
+
+    Items become buttons of one inline keyboard followed by the page and
+    footer buttons, so showing any list costs one Bot API call.
+    """
+    keyboard = build_menu(
+        [item_button(item) for item in page["items"]], n_cols=n_cols
+    )
+
+    page_buttons = get_page_buttons(page)
+    if page_buttons:
+        keyboard.append(page_buttons)
+
+    if footer_buttons:
+        keyboard.append(list(footer_buttons))
+
+    return {"text": text, "reply_markup": InlineKeyboardMarkup(keyboard)}
@@ -1,8 +1,103 @@
+import pickle
+import sys
 from decimal import Decimal
+
 from django.conf import settings
 
 from orders.models import Product
 
+# minor currency units in a major one
+MINOR_UNITS = 100
+
+
+def to_minor(amount):
+    """convert major currency amount to integer minor units"""
+    return int(Decimal(amount) * MINOR_UNITS)
+
+
+def to_major(amount):
+    """convert integer minor units to Decimal major amount"""
+    return Decimal(amount) / MINOR_UNITS
+
+
+class CartItem(object):
+    """
+    Cart position stored in ``user_data``.
+
+    Keeps a snapshot of the product (id, name, version) instead of the model
+    instance, and the price in integer minor units.
+    """
+
+    __slots__ = ("product_id", "name", "version", "quantity", "price")
+
+    def __init__(self, product_id, name, version, quantity=0, price=0):
+        self.product_id = product_id
+        self.name = name
+        self.version = version
+        self.quantity = quantity
+        self.price = price
+
+    def __getstate__(self):
+        return (
+            self.product_id,
+            self.name,
+            self.version,
+            self.quantity,
+            self.price,
+        )
+
+    def __setstate__(self, state):
+        (
+            self.product_id,
+            self.name,
+            self.version,
+            self.quantity,
+            self.price,
+        ) = state
+
+    @classmethod
+    def from_product(cls, product):
+        return cls(
+            product_id=str(product.id),
+            name=product.name,
+            version=get_product_version(product.updated),
+            price=to_minor(settings.BASE_PRICE),
+        )
+
+    @property
+    def total_price(self):
+        return self.price * self.quantity
+
+
+def deep_size(value, seen=None):
+    """returns bytes taken by value and everything it references"""
+    seen = set() if seen is None else seen
+
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        size += sum(
+            deep_size(key, seen) + deep_size(item, seen)
+            for key, item in value.items()
+        )
+    elif hasattr(value, "__dict__"):
+        size += deep_size(vars(value), seen)
+    elif hasattr(value, "__slots__"):
+        size += sum(
+            deep_size(getattr(value, name), seen) for name in value.__slots__
+        )
+
+    return size
+
+
+def get_product_version(updated):
+    """returns product version from its last update time"""
+    return int(updated.timestamp() * 1000) if updated else 0
+
 
 class Cart(object):
     """Cart"""
@@ -15,47 +110,82 @@ class Cart(object):
             cart = self.session[settings.CART_SESSION_ID] = {}
         self.cart = cart
 
+        # carts saved before CartItem kept dicts with model instances
+        for product_id, item in list(self.cart.items()):
+            if isinstance(item, dict):
+                self.cart[product_id] = CartItem(
+                    product_id=product_id,
+                    name=getattr(item.get("product"), "name", ""),
+                    version=0,
+                    quantity=item["quantity"],
+                    price=to_minor(item["price"]),
+                )
+
     def add(self, product, quantity=1):
         product_id = str(product.id)
 
         if product_id not in self.cart:
-            self.cart[product_id] = {
-                "quantity": 0,
-                "price": settings.BASE_PRICE,
-            }
-        self.cart[product_id]["quantity"] += quantity
+            self.cart[product_id] = CartItem.from_product(product)
+        self.cart[product_id].quantity += quantity
         self.save()
 
     def save(self):
         self.session[settings.CART_SESSION_ID] = self.cart
         self.session["modified"] = True
 
-    def remove(self, product):
-        product_id = str(product.id)
+    def remove(self, product_id):
+        product_id = str(product_id)
         if product_id in self.cart:
             del self.cart[product_id]
             self.save()
 
-    def __iter__(self):
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(id__in=product_ids)
-        for product in products:
-            self.cart[str(product.id)]["product"] = product
+    def refresh(self):
+        """
+        Update product snapshots with one query, products deleted since
+        they were added are dropped from the cart.
+        """
+        snapshots = {
+            str(product_id): (name, get_product_version(updated))
+            for product_id, name, updated in Product.objects.filter(
+                id__in=list(self.cart)
+            ).values_list("id", "name", "updated")
+        }
+        changed = False
 
-        for item in self.cart.values():
-            item["price"] = Decimal(item["price"])
-            item["total_price"] = item["price"] * item["quantity"]
-            yield item
+        for product_id, item in list(self.cart.items()):
+            snapshot = snapshots.get(product_id)
+
+            if snapshot is None:
+                del self.cart[product_id]
+                changed = True
+            elif snapshot != (item.name, item.version):
+                item.name, item.version = snapshot
+                changed = True
+
+        if changed:
+            self.save()
+
+    def __iter__(self):
+        return iter(list(self.cart.values()))
 
     def __len__(self):
-        return sum(item["quantity"] for item in self.cart.values())
+        return sum(item.quantity for item in self.cart.values())
+
+    def get_total_amount(self):
+        """returns total price in minor units"""
+        return sum(item.total_price for item in self.cart.values())
 
     def get_total_price(self):
-        return sum(
-            Decimal(item["price"]) * item["quantity"]
-            for item in self.cart.values()
-        )
+        return to_major(self.get_total_amount())
 
     def clear(self):
         del self.session[settings.CART_SESSION_ID]
         self.session["modified"] = True
+
+    def memory_size(self):
+        """returns bytes taken by the cart dict and its items"""
+        return deep_size(self.cart)
+
+    def serialized_size(self):
+        """returns bytes of the cart in the persisted user data"""
+        return len(pickle.dumps(self.cart, protocol=pickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,93 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+from common_users.services.pagination import NEXT, paginate_sequence
+from core.cache import TTLCache
+from orders.models import Category, Product
+
+
+def index_by_id(items):
+    """returns {str(id): position} of ordered items"""
+    return {str(item["id"]): index for index, item in enumerate(items)}
+
+
+def is_available(product, now):
+    """Product.is_available of a cached product row"""
+    if product["is_free"]:
+        return True
+    return (
+        product["expiration_date"] is not None
+        and product["expiration_date"] < now
+    )
+
+
+class CatalogCache(TTLCache):
+    """
+    In-process read model of active categories and their products.
+
+    Availability is evaluated on read from ``is_free`` and
+    ``expiration_date``, so expiring bookings need no invalidation. Model
+    signals and booking writes invalidate it, and ``ttl`` bounds staleness
+    for changes made by other processes (admin, other bot instances).
+    """
+
+    def _load(self):
+        categories = list(
+            Category.objects.filter(is_active=True)
+            .order_by("name")
+            .values("id", "name")
+        )
+        products = defaultdict(list)
+
+        for product in (
+            Product.objects.filter(category__is_active=True)
+            .order_by("name")
+            .values("id", "name", "category_id", "is_free", "expiration_date")
+        ):
+            products[str(product["category_id"])].append(product)
+
+        # category id -> (products ordered by name, their positions)
+        products = {
+            category_id: (items, index_by_id(items))
+            for category_id, items in products.items()
+        }
+        return (categories, index_by_id(categories)), products
+
+    def get_categories(self, cursor=None, direction=NEXT, per_page=10):
+        """returns page of active categories having free products"""
+        (categories, positions), products = self._get()
+        now = timezone.now()
+
+        def build(category):
+            items, _ = products.get(str(category["id"]), ((), None))
+            product_count = sum(is_available(item, now) for item in items)
+
+            if product_count:
+                category = Category(**category)
+                category.product_count = product_count
+                return category
+
+        return paginate_sequence(
+            categories, positions, cursor, direction, per_page, build
+        )
+
+    def get_products(
+        self, category_id, cursor=None, direction=NEXT, per_page=10, busy=()
+    ):
+        """returns page of free products of category, except ``busy`` ids"""
+        _, products = self._get()
+        items, positions = products.get(str(category_id), ((), {}))
+        now = timezone.now()
+
+        def build(product):
+            if is_available(product, now) and str(product["id"]) not in busy:
+                return Product(**product)
+
+        return paginate_sequence(
+            items, positions, cursor, direction, per_page, build
+        )
+
+
+catalog_cache = CatalogCache(settings.CATALOG_CACHE_TTL)
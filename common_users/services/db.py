@@ -0,0 +1,88 @@
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from common_users.services.metrics import (
+    DB_QUEUE_DEPTH,
+    DB_THREADS,
+    DB_THREADS_BUSY,
+)
+from common_users.services.tracing import CLIENT, tracer
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.BOT_DB_THREADS, thread_name_prefix="bot-db"
+)
+
+DB_THREADS.set(settings.BOT_DB_THREADS)
+
+
+class QueuedCall(object):
+    """ORM call waiting for a free database thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queued = True
+        DB_QUEUE_DEPTH.inc()
+
+    def dequeue(self):
+        with self._lock:
+            if not self._queued:
+                return
+            self._queued = False
+        DB_QUEUE_DEPTH.dec()
+
+
+def close_obsolete_connections():
+    """
+    Close connections older than CONN_MAX_AGE or broken by an error.
+
+    Unlike ``close_old_connections`` a healthy connection is left alone, so
+    CONN_HEALTH_CHECKS does not add a ``SELECT 1`` before every call.
+    """
+    now = time.monotonic()
+    for connection in connections.all(initialized_only=True):
+        if connection.errors_occurred or (
+            connection.close_at is not None and now >= connection.close_at
+        ):
+            connection.close_if_unusable_or_obsolete()
+
+
+def database_sync_to_async(func):
+    """
+    Run ORM code in the bot database thread pool.
+
+    Plain ``sync_to_async`` (and Django's own ``aget``/``acount``, which use
+    it internally) funnels every call through one thread-sensitive thread, so
+    the whole bot does one query at a time. Calls wrapped here run on up to
+    ``settings.BOT_DB_THREADS`` threads, each keeping its own connection.
+    The undecorated function stays available as ``func``.
+    """
+
+    def inner(queued, *args, **kwargs):
+        queued.dequeue()
+        DB_THREADS_BUSY.inc()
+        try:
+            with tracer.span(f"db {func.__name__}", CLIENT):
+                close_obsolete_connections()
+                return func(*args, **kwargs)
+        finally:
+            DB_THREADS_BUSY.dec()
+
+    call = sync_to_async(inner, thread_sensitive=False, executor=executor)
+
+    @functools.wraps(func)
+    async def submit(*args, **kwargs):
+        queued = QueuedCall()
+        try:
+            return await call(queued, *args, **kwargs)
+        finally:
+            # cancelled before a thread picked the call up
+            queued.dequeue()
+
+    submit.func = func
+    return submit
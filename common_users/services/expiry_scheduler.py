@@ -0,0 +1,145 @@
+import asyncio
+import heapq
+import logging
+import threading
+from datetime import timedelta
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = timedelta(seconds=60)
+
+
+class ExpiryScheduler(object):
+    """
+    Min-heap of product expiration deadlines.
+
+    Only the earliest deadline is armed as a job queue job, so the bot wakes
+    up when a booking expires instead of sweeping the whole table every
+    minute. Availability is computed at read time, so the release write can
+    be delayed by ``delay`` to batch deadlines that are close together.
+    Deadlines may be registered from any thread (bot_tools helpers run
+    inside sync_to_async workers).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._heap = []
+        self._deadlines = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._job_queue = None
+        self._callback = None
+        self._job = None
+        self._armed_at = None
+        self._delay = timedelta(0)
+
+    def start(self, job_queue, callback, pending=(), delay=timedelta(0)):
+        """
+        Bind scheduler to the running application.
+
+        ``callback`` is a coroutine function called with the job context and
+        the list of expired product ids. ``pending`` is an iterable of
+        ``(product_id, deadline)`` pairs loaded from the database.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._delay = delay
+        self._job_queue = job_queue
+        self._callback = callback
+
+        self.load(pending)
+        logger.info("%s scheduler started, %s pending", self.name, len(self))
+
+    def load(self, pending):
+        """merge ``(product_id, deadline)`` pairs into the pending set"""
+        with self._lock:
+            for product_id, deadline in pending:
+                self._push(product_id, deadline)
+
+        if self._job_queue is not None:
+            self._rearm()
+
+    def schedule(self, product_id, deadline):
+        """register (or move) product expiration deadline"""
+        if self._job_queue is None:
+            # nothing would pop it here, the scheduler of the maintenance
+            # lease holder loads the deadline from the database
+            return
+
+        with self._lock:
+            self._push(product_id, deadline)
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._rearm)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def _push(self, product_id, deadline):
+        product_id = str(product_id)
+        if self._deadlines.get(product_id) == deadline:
+            return
+        self._deadlines[product_id] = deadline
+        heapq.heappush(self._heap, (deadline, product_id))
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, product_id = heapq.heappop(self._heap)
+                # skip stale entries left after a deadline was moved
+                if self._deadlines.get(product_id) == deadline:
+                    del self._deadlines[product_id]
+                    due.append(product_id)
+        return due
+
+    def _next_deadline(self):
+        with self._lock:
+            while self._heap:
+                deadline, product_id = self._heap[0]
+                if self._deadlines.get(product_id) == deadline:
+                    return deadline
+                heapq.heappop(self._heap)
+        return None
+
+    def _rearm(self):
+        deadline = self._next_deadline()
+
+        if deadline is None:
+            return
+
+        if self._job is not None and self._armed_at <= deadline:
+            return
+
+        if self._job is not None:
+            self._job.schedule_removal()
+
+        self._armed_at = deadline
+        self._job = self._job_queue.run_once(
+            self._fire,
+            when=max(deadline + self._delay, timezone.now()),
+            name=self.name,
+        )
+
+    async def _fire(self, context):
+        self._job = None
+        self._armed_at = None
+
+        product_ids = self._pop_due(timezone.now())
+
+        try:
+            if product_ids:
+                await self._callback(context, product_ids)
+        except Exception:
+            logger.exception("Failed to process %s deadlines", self.name)
+            retry_at = timezone.now() + RETRY_DELAY
+            with self._lock:
+                for product_id in product_ids:
+                    self._push(product_id, retry_at)
+        finally:
+            self._rearm()
+
+
+expiry_scheduler = ExpiryScheduler("product_expiration")
+reminder_scheduler = ExpiryScheduler("product_reminder")
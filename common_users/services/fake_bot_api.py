@@ -0,0 +1,268 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+from email.parser import BytesParser
+from urllib.parse import parse_qsl
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Load test bot",
+    "username": "load_test_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+# parameters PTB sends JSON encoded, plain strings are sent as they are
+JSON_PARAMETERS = ("reply_markup", "prices", "entities", "ok", "show_alert")
+
+
+class BotCall(object):
+    """Bot API request addressed to a chat"""
+
+    __slots__ = ("method", "params", "message", "received")
+
+    def __init__(self, method, params, message=None):
+        self.method = method
+        self.params = params
+        self.message = message
+        self.received = time.perf_counter()
+
+    @property
+    def text(self):
+        return self.params.get("text") or ""
+
+    @property
+    def buttons(self):
+        """returns (text, callback data) of the inline keyboard"""
+        markup = self.params.get("reply_markup") or {}
+        return [
+            (button["text"], str(button["callback_data"]))
+            for row in markup.get("inline_keyboard", ())
+            for button in row
+            if "callback_data" in button
+        ]
+
+
+def parse_form(content_type, body):
+    """returns fields of an urlencoded or multipart request body"""
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params = {
+            part.get_param("name", header="content-disposition"): (
+                part.get_payload(decode=True).decode()
+            )
+            for part in message.get_payload()
+        }
+    else:
+        params = dict(parse_qsl(body.decode(), keep_blank_values=True))
+
+    for name in JSON_PARAMETERS:
+        if name in params:
+            params[name] = json.loads(params[name])
+    return params
+
+
+class FakeBotApi(object):
+    """
+    Local stand-in for the Telegram Bot API.
+
+    ``Application.builder().base_url(api.base_url)`` points a bot at it.
+    Updates are queued with ``push_update`` and served by long polling
+    ``getUpdates``. Every request addressed to a chat is put on
+    ``chats[chat_id]``, so synthetic users can wait for the bot's answer.
+    Sent messages are kept, so callback queries can refer to them.
+    """
+
+    def __init__(self):
+        self.host = None
+        self.port = None
+        self.chats = defaultdict(asyncio.Queue)
+        self.calls = Counter()
+        self._server = None
+        self._connections = {}
+        self._updates = []
+        self._new_updates = asyncio.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._query_ids = itertools.count(1)
+        # callback and pre-checkout query id -> chat id
+        self._query_chats = {}
+        self._messages = {}
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        self._server.close()
+        # wake up pending long polls and let the connections finish
+        async with self._new_updates:
+            self._new_updates.notify_all()
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def push_update(self, **update):
+        """queue an update for getUpdates, returns its id"""
+        update_id = next(self._update_ids)
+        async with self._new_updates:
+            self._updates.append({"update_id": update_id, **update})
+            self._new_updates.notify_all()
+        return update_id
+
+    def new_query_id(self, chat_id):
+        query_id = str(next(self._query_ids))
+        self._query_chats[query_id] = chat_id
+        return query_id
+
+    async def _handle(self, reader, writer):
+        self._connections[asyncio.current_task()] = writer
+        try:
+            # httpx keeps connections alive between requests
+            while True:
+                request = await reader.readline()
+                if not request:
+                    return
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(
+                    int(headers.get("content-length", 0))
+                )
+                method = request.split()[1].decode().rsplit("/", 1)[-1]
+                params = parse_form(headers.get("content-type", ""), body)
+
+                result = await self._call(method, params)
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def _call(self, method, params):
+        self.calls[method] += 1
+        handler = getattr(self, f"api_{method.lower()}", None)
+
+        if handler is None:
+            return True
+        return await handler(params)
+
+    async def api_getme(self, params):
+        return BOT_USER
+
+    async def api_getupdates(self, params):
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        timeout = float(params.get("timeout", 0))
+
+        async with self._new_updates:
+            # updates below the offset were confirmed by the bot
+            self._updates = [
+                update
+                for update in self._updates
+                if update["update_id"] >= offset
+            ]
+            if not self._updates and timeout:
+                try:
+                    await asyncio.wait_for(
+                        self._new_updates.wait(), timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            return self._updates[:limit]
+
+    def _record(self, method, params, message=None):
+        chat_id = params.get("chat_id")
+        if chat_id is None:
+            chat_id = self._query_chats.pop(
+                params.get("callback_query_id")
+                or params.get("pre_checkout_query_id"),
+                None,
+            )
+        if chat_id is not None:
+            self.chats[int(chat_id)].put_nowait(
+                BotCall(method, params, message)
+            )
+
+    def _new_message(self, params, **fields):
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+        if "inline_keyboard" in (params.get("reply_markup") or {}):
+            # reply keyboards are not part of the sent message
+            message["reply_markup"] = params["reply_markup"]
+
+        self._messages[chat_id, message["message_id"]] = message
+        return message
+
+    async def api_sendmessage(self, params):
+        message = self._new_message(params, text=params.get("text", ""))
+        self._record("sendMessage", params, message)
+        return message
+
+    async def api_editmessagetext(self, params):
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        message = self._messages.get(key) or self._new_message(params)
+        message["text"] = params.get("text", "")
+        message["edit_date"] = int(time.time())
+        if "inline_keyboard" in (params.get("reply_markup") or {}):
+            message["reply_markup"] = params["reply_markup"]
+        else:
+            message.pop("reply_markup", None)
+
+        self._record("editMessageText", params, message)
+        return message
+
+    async def api_sendinvoice(self, params):
+        message = self._new_message(
+            params,
+            invoice={
+                "title": params.get("title", ""),
+                "description": params.get("description", ""),
+                "start_parameter": "",
+                "currency": params.get("currency", ""),
+                "total_amount": sum(
+                    price["amount"] for price in params.get("prices", ())
+                ),
+            },
+        )
+        self._record("sendInvoice", params, message)
+        return message
+
+    async def api_answercallbackquery(self, params):
+        self._record("answerCallbackQuery", params)
+        return True
+
+    async def api_answerprecheckoutquery(self, params):
+        self._record("answerPreCheckoutQuery", params)
+        return True
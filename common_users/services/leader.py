@@ -0,0 +1,109 @@
+import logging
+import os
+import socket
+import weakref
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Q
+from django.utils import timezone
+
+from common_users.services.metrics import LEASE_HOLDER, LEASE_IS_LEADER
+from orders.models import JobLease
+
+logger = logging.getLogger(__name__)
+
+# leases of this process, read by the lease gauges on every scrape
+leases = weakref.WeakSet()
+
+
+class LeaderLease(object):
+    """
+    Lease row based leader election.
+
+    Every bot instance periodically tries to take or renew the lease with a
+    single conditional UPDATE, which behaves the same on Postgres and SQLite.
+    The instance holding a non-expired lease runs the maintenance jobs, and
+    another one takes over once the lease runs out.
+    """
+
+    def __init__(self, name, ttl, node=None):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl)
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self.holder = None
+        self.expires_at = None
+        self.transitions = 0
+        leases.add(self)
+
+    def acquire(self):
+        """try to take or renew the lease, returns True for the leader"""
+        now = timezone.now()
+        expires_at = now + self.ttl
+
+        try:
+            JobLease.objects.get_or_create(
+                name=self.name,
+                defaults={"holder": self.node, "expires_at": expires_at},
+            )
+            JobLease.objects.filter(
+                Q(holder=self.node) | Q(expires_at__lt=now),
+                name=self.name,
+            ).update(holder=self.node, expires_at=expires_at, updated=now)
+            holder, lease_expires_at = JobLease.objects.values_list(
+                "holder", "expires_at"
+            ).get(name=self.name)
+        except DatabaseError:
+            logger.exception("Failed to renew %s lease", self.name)
+            self._set_leader(False, None, None)
+            return False
+
+        self._set_leader(holder == self.node, holder, lease_expires_at)
+        return self.is_leader
+
+    def release(self):
+        """give the lease away so another instance takes over at once"""
+        if not self.is_leader:
+            return
+
+        JobLease.objects.filter(name=self.name, holder=self.node).update(
+            expires_at=timezone.now()
+        )
+        self._set_leader(False, None, None)
+
+    def status(self):
+        return {
+            "name": self.name,
+            "node": self.node,
+            "is_leader": self.is_leader,
+            "holder": self.holder,
+            "expires_at": self.expires_at,
+            "transitions": self.transitions,
+        }
+
+    def _set_leader(self, is_leader, holder, expires_at):
+        if is_leader != self.is_leader:
+            self.transitions += 1
+            logger.info(
+                "%s %s %s lease (holder: %s)",
+                self.node,
+                "acquired" if is_leader else "lost",
+                self.name,
+                holder,
+            )
+
+        self.is_leader = is_leader
+        self.holder = holder
+        self.expires_at = expires_at
+
+
+LEASE_HOLDER.function = lambda: {
+    (lease.name, lease.holder): 1 for lease in leases if lease.holder
+}
+LEASE_IS_LEADER.function = lambda: {
+    (lease.name,): int(lease.is_leader) for lease in leases
+}
+
+maintenance_lease = LeaderLease("maintenance", settings.JOB_LEASE_TTL)
@@ -0,0 +1,345 @@
+import asyncio
+import bisect
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+# seconds, from fast cached handlers to slow payment flows
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+
+    def escape(value):
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+
+    return "{%s}" % ",".join(
+        f'{name}="{escape(value)}"' for name, value in pairs
+    )
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    """Metric"""
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self):
+        """returns (suffix, label values, extra labels, value) rows"""
+        with self._lock:
+            return [
+                ("", key, (), value) for key, value in self._values.items()
+            ]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, key, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}"
+                f"{format_labels(self.labels, key, extra)} "
+                f"{format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Counter"""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Gauge set by the code, or read from ``function`` on every scrape.
+
+    ``function`` returns a number, or {label values tuple: number} for a
+    labelled gauge.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+
+        try:
+            values = self.function()
+        except Exception:
+            logger.exception("Failed to collect %s", self.name)
+            return []
+
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [("", key, (), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    """Histogram"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=None):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets or DEFAULT_BUCKETS)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0)
+            )
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+
+        rows = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                rows.append(
+                    (
+                        "_bucket",
+                        key,
+                        (("le", format_value(bound)),),
+                        cumulative,
+                    )
+                )
+            rows.append(("_sum", key, (), total))
+            rows.append(("_count", key, (), cumulative))
+        return rows
+
+
+class Registry(object):
+    """Registry"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """returns metrics in the Prometheus text exposition format"""
+        return "\n".join(metric.render() for metric in self._metrics.values())
+
+
+registry = Registry()
+
+HANDLER_SECONDS = registry.register(
+    Histogram(
+        "bot_handler_seconds",
+        "Conversation handler latency",
+        labels=("state", "handler"),
+    )
+)
+UPDATE_LAG_SECONDS = registry.register(
+    Histogram(
+        "bot_update_lag_seconds",
+        "Time from the Telegram message date to the handler start",
+        labels=("state",),
+        buckets=LAG_BUCKETS,
+    )
+)
+HANDLER_ERRORS = registry.register(
+    Counter(
+        "bot_handler_errors_total",
+        "Errors raised while processing updates",
+        labels=("error",),
+    )
+)
+UPDATE_QUEUE_DEPTH = registry.register(
+    Gauge("bot_update_queue_depth", "Updates waiting to be processed")
+)
+USER_QUEUE_UPDATES = registry.register(
+    Gauge(
+        "bot_user_queue_updates",
+        "Updates waiting or in progress in the per-user queues",
+    )
+)
+OUTBOUND_SECONDS = registry.register(
+    Histogram(
+        "bot_outbound_request_seconds",
+        "Bot API request latency, without the rate limiter wait",
+        labels=("endpoint",),
+    )
+)
+OUTBOUND_RETRY_AFTER = registry.register(
+    Counter(
+        "bot_outbound_retry_after_total",
+        "Bot API requests answered with 429 Too Many Requests",
+        labels=("endpoint",),
+    )
+)
+OUTBOUND_QUEUE_DEPTH = registry.register(
+    Gauge(
+        "bot_outbound_queue_depth",
+        "Bot API requests waiting for a rate limiter slot",
+    )
+)
+DB_THREADS = registry.register(
+    Gauge("bot_db_threads", "Threads of the bot database executor")
+)
+DB_THREADS_BUSY = registry.register(
+    Gauge("bot_db_threads_busy", "Database executor threads running ORM code")
+)
+DB_QUEUE_DEPTH = registry.register(
+    Gauge(
+        "bot_db_queue_depth",
+        "ORM calls waiting for a free database executor thread",
+    )
+)
+EXPIRY_JOB_SECONDS = registry.register(
+    Histogram(
+        "bot_expiry_job_seconds",
+        "Duration of the expired bookings release job",
+    )
+)
+EXPIRY_RELEASED = registry.register(
+    Counter("bot_expiry_released_total", "Bookings released by the expiry job")
+)
+INGEST_QUEUE_DEPTH = registry.register(
+    Gauge(
+        "bot_ingest_queue_depth",
+        "Stored webhook updates not processed yet",
+    )
+)
+INGEST_LAG_SECONDS = registry.register(
+    Gauge(
+        "bot_ingest_lag_seconds",
+        "Age of the oldest stored webhook update not processed yet",
+    )
+)
+INGEST_INFLIGHT = registry.register(
+    Gauge(
+        "bot_ingest_inflight_updates",
+        "Stored webhook updates handed to user workers",
+    )
+)
+LEASE_HOLDER = registry.register(
+    Gauge(
+        "bot_lease_holder",
+        "Instance holding a job lease, as seen by this process",
+        labels=("lease", "holder"),
+    )
+)
+LEASE_IS_LEADER = registry.register(
+    Gauge(
+        "bot_lease_is_leader",
+        "Whether this process holds the job lease",
+        labels=("lease",),
+    )
+)
+
+
+class MetricsServer(object):
+    """Minimal HTTP listener answering GET /metrics"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._server = None
+
+    async def start(self, host, port):
+        try:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        except OSError as exc:
+            # e.g. another process of a multi-worker ASGI server has it
+            logger.warning("Metrics not served on %s:%s: %s", host, port, exc)
+            return
+        logger.info("Metrics served on %s:%s", host, port)
+
+    async def stop(self):
+        if self._server is None:
+            return
+
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # headers are not needed
+            while await reader.readline() not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request.split()
+            if len(parts) >= 2 and parts[1].split(b"?")[0] == b"/metrics":
+                status = "200 OK"
+                body = (self.registry.render() + "\n").encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+metrics_server = MetricsServer(registry)
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from telegram.constants import ParseMode
+
+from common_users.services.rate_limiter import REMINDER
+
+logger = logging.getLogger(__name__)
+
+
+def group_by_user(rows, render):
+    """group rendered lines by the ``telegram_user_id`` of each row"""
+    messages = defaultdict(list)
+
+    for row in rows:
+        if row["telegram_user_id"]:
+            messages[row["telegram_user_id"]].append(render(row))
+
+    return messages
+
+
+async def notify_users(bot, messages, priority=REMINDER):
+    """send one message per user concurrently"""
+    chat_ids = list(messages)
+    results = await asyncio.gather(
+        *(
+            bot.send_message(
+                chat_id=chat_id,
+                text="\n".join(messages[chat_id]),
+                parse_mode=ParseMode.HTML,
+                rate_limit_args=priority,
+            )
+            for chat_id in chat_ids
+        ),
+        return_exceptions=True,
+    )
+
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logger.warning("Failed to notify %s: %s", chat_id, result)
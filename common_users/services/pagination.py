@@ -0,0 +1,103 @@
+from django.db.models import Q, Subquery
+
+NEXT = "next"
+PREV = "prev"
+
+
+def page_callback(direction, item):
+    """returns callback data of a page button"""
+    return f"{direction}:{item.id}"
+
+
+def parse_page_callback(data):
+    """returns (direction, cursor id) of a page button, cursor is None
+    for any other callback"""
+    direction, _, cursor = data.partition(":")
+
+    if direction not in (NEXT, PREV) or not cursor:
+        return NEXT, None
+    return direction, cursor
+
+
+def make_page(items, cursor, direction, per_page):
+    """
+    Build page from up to ``per_page + 1`` items read from the cursor in
+    ``direction``, the extra item only tells whether there is more.
+    """
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if direction == PREV:
+        items.reverse()
+        return {"items": items, "has_previous": has_more, "has_next": True}
+
+    return {
+        "items": items,
+        "has_previous": cursor is not None,
+        "has_next": has_more,
+    }
+
+
+def paginate_queryset(
+    queryset, field, cursor=None, direction=NEXT, per_page=10
+):
+    """
+    Keyset pagination over ``(field, pk)``.
+
+    The page starts right after (or, for PREV, right before) the cursor row,
+    so every page is one index range scan of ``per_page + 1`` rows, without
+    OFFSET or COUNT.
+    """
+    base = queryset
+
+    if cursor is not None:
+        value = Subquery(
+            queryset.model.objects.filter(pk=cursor).values(field)[:1]
+        )
+        lookup = "gt" if direction == NEXT else "lt"
+        queryset = queryset.filter(
+            Q(**{f"{field}__{lookup}": value})
+            | Q(**{field: value, f"pk__{lookup}": cursor})
+        )
+
+    if direction == NEXT:
+        queryset = queryset.order_by(field, "pk")
+    else:
+        queryset = queryset.order_by(f"-{field}", "-pk")
+
+    items = list(queryset[: per_page + 1])
+
+    if cursor is not None and not items:
+        # the cursor row is gone, start over
+        return paginate_queryset(base, field, per_page=per_page)
+
+    return make_page(items, cursor, direction, per_page)
+
+
+def paginate_sequence(items, positions, cursor, direction, per_page, build):
+    """
+    Keyset pagination over an ordered in-memory sequence.
+
+    ``positions`` maps item ids to their index, ``build`` returns the page
+    entry for an item or None to skip it. Only the items of the page (and
+    skipped ones) are visited, whatever the cursor position.
+    """
+    index = positions.get(cursor)
+
+    if index is None:
+        cursor, direction = None, NEXT
+        indexes = range(len(items))
+    elif direction == NEXT:
+        indexes = range(index + 1, len(items))
+    else:
+        indexes = range(index - 1, -1, -1)
+
+    page = []
+    for index in indexes:
+        entry = build(items[index])
+        if entry is not None:
+            page.append(entry)
+            if len(page) > per_page:
+                break
+
+    return make_page(page, cursor, direction, per_page)
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+import time
+
+from django.conf import settings
+from telegram.ext import BasePersistence, PersistenceInput
+
+from common_users.models import BotConversation, BotUserData
+from common_users.services.db import database_sync_to_async
+
+logger = logging.getLogger(__name__)
+
+
+@database_sync_to_async
+def load_user_data(telegram_user_id):
+    """returns pickled user data or None"""
+    data = (
+        BotUserData.objects.filter(telegram_user_id=telegram_user_id)
+        .values_list("data", flat=True)
+        .first()
+    )
+    return bytes(data) if data is not None else None
+
+
+@database_sync_to_async
+def save_user_data(user_data, conversations):
+    """upsert user data and conversation states in two statements"""
+    if user_data:
+        BotUserData.objects.bulk_create(
+            [
+                BotUserData(telegram_user_id=user_id, data=data)
+                for user_id, data in user_data.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["telegram_user_id"],
+            update_fields=["data", "updated"],
+        )
+
+    if conversations:
+        BotConversation.objects.bulk_create(
+            [
+                BotConversation(name=name, key=key, state=state)
+                for (name, key), state in conversations.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["name", "key"],
+            update_fields=["state", "updated"],
+        )
+
+
+@database_sync_to_async
+def delete_user_data(telegram_user_id):
+    BotUserData.objects.filter(telegram_user_id=telegram_user_id).delete()
+
+
+@database_sync_to_async
+def load_conversations(name):
+    return list(
+        BotConversation.objects.filter(
+            name=name, state__isnull=False
+        ).values_list("key", "state")
+    )
+
+
+@database_sync_to_async
+def load_user_conversations(key):
+    """returns {conversation name: state} of one conversation key"""
+    return dict(
+        BotConversation.objects.filter(key=json.dumps(key)).values_list(
+            "name", "state"
+        )
+    )
+
+
+class DjangoPersistence(BasePersistence):
+    """
+    Stores user_data and conversation states in the database.
+
+    * user data is loaded per user on demand in ``refresh_user_data``
+      instead of all at startup;
+    * changes are buffered and written behind in one batched upsert, users
+      whose pickled data did not change since the last write are skipped;
+    * data of users idle for ``settings.BOT_SESSION_IDLE_TIMEOUT`` seconds is
+      evicted from memory after it has been written, and loaded again on
+      their next update.
+    """
+
+    def __init__(self, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        # telegram user id -> (user_data dict, last access time)
+        self._sessions = {}
+        self._digests = {}
+        self._pending_user_data = {}
+        self._pending_conversations = {}
+        self._write_task = None
+
+    async def get_user_data(self):
+        # loaded lazily in refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        session = self._sessions.get(user_id)
+
+        if session is None or session[0] is not user_data:
+            data = await load_user_data(user_id)
+            if data is not None:
+                user_data.update(pickle.loads(data))
+                self._digests[user_id] = hashlib.sha1(data).digest()
+
+        self._sessions[user_id] = (user_data, time.monotonic())
+
+    async def update_user_data(self, user_id, data):
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha1(payload).digest()
+
+        if self._digests.get(user_id) == digest:
+            return
+
+        self._digests[user_id] = digest
+        self._pending_user_data[user_id] = payload
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._sessions.pop(user_id, None)
+        self._digests.pop(user_id, None)
+        self._pending_user_data.pop(user_id, None)
+        await delete_user_data(user_id)
+
+    async def get_conversations(self, name):
+        return {
+            tuple(json.loads(key)): state
+            for key, state in await load_conversations(name)
+        }
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, json.dumps(key))] = new_state
+        self._schedule_write()
+
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+        await self._write()
+
+    def forget_user(self, user_id):
+        """drop user data from memory, it is loaded again on next update"""
+        session = self._sessions.pop(user_id, None)
+        self._digests.pop(user_id, None)
+
+        if session is not None:
+            session[0].clear()
+
+    def forget_all_users(self):
+        """drop data of every user from memory"""
+        for user_id in list(self._sessions):
+            self.forget_user(user_id)
+
+    def _schedule_write(self):
+        # Application.update_persistence calls update_* for every touched
+        # user at once, the task runs after all of them and writes one batch
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        user_data = self._pending_user_data
+        conversations = self._pending_conversations
+        self._pending_user_data = {}
+        self._pending_conversations = {}
+
+        if user_data or conversations:
+            try:
+                await save_user_data(user_data, conversations)
+            except Exception:
+                logger.exception("Failed to save bot user data")
+                # keep the changes for the next run
+                for user_id, payload in user_data.items():
+                    self._pending_user_data.setdefault(user_id, payload)
+                for key, state in conversations.items():
+                    self._pending_conversations.setdefault(key, state)
+                return
+
+        self._evict_idle()
+
+    def _evict_idle(self):
+        idle_before = time.monotonic() - settings.BOT_SESSION_IDLE_TIMEOUT
+
+        for user_id, (user_data, accessed) in list(self._sessions.items()):
+            if (
+                accessed < idle_before
+                and user_id not in self._pending_user_data
+            ):
+                # PTB keeps the (now empty) dict, refresh_user_data loads it
+                # again because the session is gone
+                user_data.clear()
+                del self._sessions[user_id]
+                self._digests.pop(user_id, None)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
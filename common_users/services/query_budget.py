@@ -0,0 +1,162 @@
+import contextvars
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from common_users.services.metrics import HANDLER_SECONDS, UPDATE_LAG_SECONDS
+from common_users.services.tracing import SERVER, get_trace_id, tracer
+
+logger = logging.getLogger(__name__)
+
+# statistics of the update being handled, sync_to_async copies the context
+# into the database threads so their queries are counted as well
+current_stats = contextvars.ContextVar("query_stats", default=None)
+
+# states of the handlers starting a new traced conversation
+NEW_TRACE_STATES = ("entry", "fallback")
+
+
+class QueryBudgetExceeded(Exception):
+    """a handler ran more queries than it declared"""
+
+
+class QueryStats(object):
+    """SQL statements run while handling one update"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = ("", 0.0)
+
+    def add(self, sql, duration):
+        # a handler may run several ORM calls at once
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+            if duration > self.slowest[1]:
+                self.slowest = (sql, duration)
+
+    def as_dict(self):
+        return {
+            "queries": self.count,
+            "db_ms": round(self.duration * 1000, 2),
+            "slowest_ms": round(self.slowest[1] * 1000, 2),
+            "slowest_sql": self.slowest[0],
+        }
+
+
+def record_queries(execute, sql, params, many, context):
+    """connection execute wrapper counting queries of the current update"""
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(sql, time.perf_counter() - started)
+
+
+def query_budget(max_queries):
+    """declare the most queries a handler may run for one update"""
+
+    def decorator(func):
+        func.query_budget = max_queries
+        return func
+
+    return decorator
+
+
+def instrument_handler(callback, state=""):
+    """
+    Log query count, DB time and slowest statement of every call, record
+    its latency per conversation ``state`` and trace it as a span of the
+    user's conversation.
+    """
+    name = getattr(callback, "__name__", repr(callback))
+    budget = getattr(callback, "query_budget", None)
+
+    @functools.wraps(callback)
+    async def inner(update, context):
+        message = getattr(update, "message", None)
+        if message is not None and message.date is not None:
+            UPDATE_LAG_SECONDS.observe(
+                (timezone.now() - message.date).total_seconds(), state=state
+            )
+
+        trace_id = None
+        if tracer.enabled and getattr(context, "user_data", None) is not None:
+            # /start and /cancel begin a new conversation
+            trace_id = get_trace_id(context, new=state in NEW_TRACE_STATES)
+
+        with tracer.span(
+            name,
+            SERVER,
+            trace_id=trace_id,
+            state=state,
+            telegram_user_id=getattr(update.effective_user, "id", None),
+        ) as span:
+            stats = QueryStats()
+            token = current_stats.set(stats)
+            started = time.perf_counter()
+            try:
+                result = await callback(update, context)
+            finally:
+                HANDLER_SECONDS.observe(
+                    time.perf_counter() - started, state=state, handler=name
+                )
+                current_stats.reset(token)
+                record = {
+                    "handler": name,
+                    "state": state,
+                    "budget": budget,
+                    **stats.as_dict(),
+                }
+                logger.info(
+                    "handler=%(handler)s queries=%(queries)s "
+                    "db_ms=%(db_ms)s slowest_ms=%(slowest_ms)s",
+                    record,
+                    extra={"query_stats": record},
+                )
+                if span is not None:
+                    span.set(queries=stats.count, db_ms=record["db_ms"])
+
+            if span is not None:
+                span.set(next_state=result)
+
+        if budget is not None and stats.count > budget:
+            message = f"{name} ran {stats.count} queries, budget is {budget}"
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={"query_stats": record})
+
+        return result
+
+    return inner
+
+
+def instrument_conversation(conversation_handler, state_names=None):
+    """
+    Wrap the callbacks of every handler of the conversation, ``state_names``
+    maps states to the names used in metrics.
+    """
+    state_names = state_names or {}
+    handlers = [
+        *(("entry", handler) for handler in conversation_handler.entry_points),
+        *(("fallback", handler) for handler in conversation_handler.fallbacks),
+        *(
+            (state_names.get(state, str(state)), handler)
+            for state, state_handlers in conversation_handler.states.items()
+            for handler in state_handlers
+        ),
+    ]
+
+    for state, handler in handlers:
+        handler.callback = instrument_handler(handler.callback, state)
+    return conversation_handler
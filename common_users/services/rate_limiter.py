@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from common_users.services.metrics import (
+    OUTBOUND_RETRY_AFTER,
+    OUTBOUND_SECONDS,
+)
+from common_users.services.tracing import CLIENT, tracer
+
+logger = logging.getLogger(__name__)
+
+# request priorities, passed as ``rate_limit_args``
+INTERACTIVE = 0
+REMINDER = 1
+BROADCAST = 2
+
+PRIORITY_NAMES = {
+    INTERACTIVE: "interactive",
+    REMINDER: "reminder",
+    BROADCAST: "broadcast",
+}
+
+STATS_INTERVAL = 60
+
+
+class TokenBucket(object):
+    """Token bucket refilled with ``rate`` tokens per second"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def delay(self, now):
+        """seconds until a token is available"""
+        self._refill(now)
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def reserve(self, now):
+        """take a token in advance, returns seconds until it is due"""
+        self._refill(now)
+        self.tokens -= 1
+        return max(0, -self.tokens / self.rate)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """
+    Rate limiter keeping outgoing requests under Telegram flood limits.
+
+    Requests addressed to a chat wait for the chat token bucket first and
+    then for a slot of the global bucket. Global slots are handed out by
+    priority (``INTERACTIVE`` replies before ``REMINDER`` notifications
+    before ``BROADCAST`` messages), FIFO within a priority. A RetryAfter
+    answer pauses all requests for the given time and the request is
+    retried. Requests without a chat (callback query answers, webhook
+    calls) are not limited.
+    """
+
+    def __init__(self, rate=30, chat_rate=1, chat_burst=3, max_retries=3):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate, rate)
+        self._chat_buckets = {}
+        self._waiters = []
+        self._counter = itertools.count()
+        self._paused_until = 0
+        self._wakeup = None
+        self._task = None
+        self._logged_at = 0
+        self.stats = Counter()
+
+    async def initialize(self):
+        # the application and its updater both initialize the bot
+        if self._task is not None:
+            return
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        chat_id = data.get("chat_id")
+
+        if chat_id is None:
+            return await self._send(endpoint, callback, args, kwargs)
+
+        priority = INTERACTIVE if rate_limit_args is None else rate_limit_args
+        attempt = 0
+
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                return await self._send(endpoint, callback, args, kwargs)
+            except RetryAfter as exc:
+                attempt += 1
+                self.stats["retry_after"] += 1
+                OUTBOUND_RETRY_AFTER.inc(endpoint=endpoint)
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + exc.retry_after
+                )
+                logger.warning(
+                    "Flood limit hit on %s, pausing for %ss (attempt %s)",
+                    endpoint,
+                    exc.retry_after,
+                    attempt,
+                )
+                if attempt > self.max_retries:
+                    raise
+
+    @staticmethod
+    async def _send(endpoint, callback, args, kwargs):
+        started = time.monotonic()
+        try:
+            with tracer.span(f"bot_api {endpoint}", CLIENT):
+                return await callback(*args, **kwargs)
+        finally:
+            OUTBOUND_SECONDS.observe(
+                time.monotonic() - started, endpoint=endpoint
+            )
+
+    async def _acquire(self, chat_id, priority):
+        now = time.monotonic()
+        bucket = self._chat_buckets.get(chat_id)
+
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate, self.chat_burst
+            )
+
+        delay = bucket.reserve(now)
+        if delay:
+            self.stats["chat_delayed"] += 1
+            await asyncio.sleep(delay)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._wakeup.set()
+        await future
+        self.stats[PRIORITY_NAMES.get(priority, priority)] += 1
+
+    async def _dispatch(self):
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = max(self._paused_until - now, self._bucket.delay(now))
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+
+            # the request was cancelled while waiting
+            if future.done():
+                continue
+
+            self._bucket.reserve(now)
+            future.set_result(None)
+            self._maintain(now)
+
+    def _maintain(self, now):
+        if now - self._logged_at < STATS_INTERVAL:
+            return
+
+        self._logged_at = now
+
+        # buckets of idle chats are full and equal to new ones
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if bucket.is_full(now):
+                del self._chat_buckets[chat_id]
+
+        stats = self.queue_stats()
+        logger.info(
+            "Outbound queue depth %s %s, %s flood waits",
+            stats["waiting"],
+            stats["waiting_by_priority"],
+            stats["retry_after"],
+        )
+
+    def queue_stats(self):
+        """returns outbound queue metrics"""
+        waiting = Counter(
+            PRIORITY_NAMES.get(priority, priority)
+            for priority, _, future in self._waiters
+            if not future.done()
+        )
+        return {
+            "waiting": sum(waiting.values()),
+            "waiting_by_priority": dict(waiting),
+            "chats": len(self._chat_buckets),
+            "paused_for": max(0, self._paused_until - time.monotonic()),
+            "retry_after": self.stats["retry_after"],
+            "sent": {
+                name: self.stats[name] for name in PRIORITY_NAMES.values()
+            },
+        }
+
+
+def get_rate_limiter():
+    """returns outbound scheduler configured from settings"""
+    return OutboundScheduler(
+        rate=settings.BOT_RATE_LIMIT,
+        chat_rate=settings.BOT_CHAT_RATE_LIMIT,
+        chat_burst=settings.BOT_CHAT_RATE_BURST,
+        max_retries=settings.BOT_RATE_LIMIT_RETRIES,
+    )
@@ -0,0 +1,339 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+from common_users.services.application import ReloadableConversationHandler
+from common_users.services.persistence import load_user_conversations
+
+logger = logging.getLogger(__name__)
+
+# worker messages
+UPDATE = "update"
+HANDOFF_OUT = "handoff_out"
+HANDOFF_IN = "handoff_in"
+STOP = "stop"
+
+HANDOFF_TIMEOUT = 30
+
+# the only worker running the expiry schedulers and the maintenance lease,
+# workers are removed from the end so it is never removed
+MAINTENANCE_NODE = "worker-0"
+
+
+class HashRing(object):
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = {}
+
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(str(value).encode()).hexdigest()[:16], 16)
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}:{replica}")
+            self._nodes[point] = node
+            bisect.insort(self._hashes, point)
+
+    def remove(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}:{replica}")
+            del self._nodes[point]
+            self._hashes.remove(point)
+
+    def get(self, key):
+        if not self._hashes:
+            raise LookupError("Hash ring is empty")
+
+        index = bisect.bisect(self._hashes, self._hash(key))
+        return self._nodes[self._hashes[index % len(self._hashes)]]
+
+    def __len__(self):
+        return len(self._nodes) // self.replicas
+
+
+def get_metrics_port(node):
+    """returns metrics port of a worker, one above the other per worker"""
+    if not settings.BOT_METRICS_PORT:
+        return 0
+    return settings.BOT_METRICS_PORT + int(node.rpartition("-")[2])
+
+
+async def worker_main(node, updates, acks):
+    """process updates routed to this worker"""
+    from common_users.management.commands.telegram_bot import (
+        build_application,
+    )
+
+    application = build_application(
+        webhook=True,
+        maintenance=node == MAINTENANCE_NODE,
+        metrics_port=get_metrics_port(node),
+    )
+    loop = asyncio.get_running_loop()
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info("Bot worker %s started", node)
+
+        while True:
+            message = await loop.run_in_executor(None, updates.get)
+            kind, payload = message
+
+            if kind == UPDATE:
+                await application.update_queue.put(
+                    Update.de_json(payload, application.bot)
+                )
+
+            elif kind == HANDOFF_OUT:
+                # save the user state before another worker loads it
+                await application.update_queue.join()
+                await application.update_persistence()
+                await application.persistence.flush()
+                application.persistence.forget_user(payload)
+                acks.put((node, payload))
+
+            elif kind == HANDOFF_IN:
+                await application.update_queue.join()
+                application.persistence.forget_user(payload)
+                await reload_conversations(application, payload)
+
+            elif kind == STOP:
+                await application.update_queue.join()
+                break
+
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def reload_conversations(application, user_id):
+    """replace cached conversation states of a user taken over"""
+    key = (user_id,)
+    states = await load_user_conversations(key)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if (
+                isinstance(handler, ReloadableConversationHandler)
+                and handler.persistent
+            ):
+                handler.reload_state(key, states.get(handler.name))
+
+
+def run_worker(node, updates, acks):
+    # the parent handles signals and stops workers with STOP messages
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(worker_main(node, updates, acks))
+
+
+class Dispatcher(object):
+    """
+    Fans updates out to worker processes by ``effective_user.id``.
+
+    A user always lands on the same worker, so its conversation state and
+    cart stay in one process. Workers are added with SIGUSR1 and removed
+    with SIGUSR2. Consistent hashing moves only the users of the changed
+    worker: their state is flushed by the old owner and reloaded by the new
+    one before their next update. Dead workers are restarted under the same
+    name, their queued updates wait for them.
+
+    Nothing here blocks the event loop: while a user is handed off only
+    their own updates wait, other users are routed as usual.
+    """
+
+    def __init__(self, workers):
+        self.ring = HashRing()
+        self.workers = {}
+        self.acks = multiprocessing.Queue()
+        self.owners = OrderedDict()
+        self._next_node = 0
+        self._resize = 0
+        self._loop = None
+        # (owner, user id) -> future resolved by the owner's ack
+        self._pending_acks = {}
+        # user id -> updates waiting for the user's handoff
+        self._handoffs = {}
+        # removed node -> future resolved once its process exited
+        self._stopping = {}
+        self._tasks = set()
+
+        for _ in range(workers):
+            self.add_worker()
+
+    def add_worker(self):
+        node = f"worker-{self._next_node}"
+        self._next_node += 1
+        self.workers[node] = {"queue": multiprocessing.Queue()}
+        self.start_worker(node)
+        self.ring.add(node)
+        logger.info("Added %s, %s workers", node, len(self.ring))
+
+    def remove_worker(self):
+        if len(self.ring) <= 1:
+            return
+
+        node = list(self.workers)[-1]
+        self.ring.remove(node)
+        worker = self.workers.pop(node)
+        # STOP waits for queued updates and flushes the worker persistence,
+        # users moving away wait for the exit instead of an ack
+        worker["queue"].put((STOP, None))
+        stopped = self._loop.run_in_executor(None, worker["process"].join)
+        self._stopping[node] = stopped
+        stopped.add_done_callback(lambda _: self._stopped(node))
+
+    def _stopped(self, node):
+        self._stopping.pop(node, None)
+        logger.info("Removed %s, %s workers", node, len(self.ring))
+
+    def start_worker(self, node):
+        # forked children must not share the parent database connections
+        connections.close_all()
+        worker = self.workers[node]
+        worker["process"] = multiprocessing.Process(
+            target=run_worker,
+            args=(node, worker["queue"], self.acks),
+            name=f"telegram-bot-{node}",
+        )
+        worker["process"].start()
+
+    def check_workers(self):
+        for node, worker in self.workers.items():
+            if not worker["process"].is_alive():
+                logger.warning("%s died, restarting", node)
+                self.start_worker(node)
+
+    def route(self, update):
+        user_id = update.effective_user.id if update.effective_user else 0
+
+        if user_id in self._handoffs:
+            self._handoffs[user_id].append(update)
+            return
+
+        node = self.ring.get(user_id)
+        owner = self.owners.pop(user_id, None)
+
+        self.owners[user_id] = node
+        if len(self.owners) > settings.BOT_DISPATCHER_OWNERS_SIZE:
+            self.owners.popitem(last=False)
+
+        if owner is not None and owner != node:
+            if owner in self.workers or owner in self._stopping:
+                self._handoffs[user_id] = [update]
+                task = asyncio.create_task(self.handoff(user_id, owner, node))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                return
+
+            self.workers[node]["queue"].put((HANDOFF_IN, user_id))
+
+        self.workers[node]["queue"].put((UPDATE, update.to_dict()))
+
+    async def handoff(self, user_id, owner, node):
+        """move user state from ``owner`` to ``node``, then route the
+        updates that arrived meanwhile"""
+        if owner in self.workers:
+            acked = self._loop.create_future()
+            self._pending_acks[owner, user_id] = acked
+            self.workers[owner]["queue"].put((HANDOFF_OUT, user_id))
+        else:
+            acked = asyncio.shield(self._stopping[owner])
+
+        try:
+            await asyncio.wait_for(acked, HANDOFF_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("%s did not hand off user %s", owner, user_id)
+        finally:
+            self._pending_acks.pop((owner, user_id), None)
+
+        # the ring may have changed meanwhile, route() handles that
+        if node in self.workers:
+            self.workers[node]["queue"].put((HANDOFF_IN, user_id))
+        for update in self._handoffs.pop(user_id):
+            self.route(update)
+
+    def read_acks(self):
+        """forward worker acks to the event loop, runs in a thread"""
+        for ack in iter(self.acks.get, None):
+            self._loop.call_soon_threadsafe(self._ack, ack)
+
+    def _ack(self, ack):
+        acked = self._pending_acks.get(ack)
+        if acked is not None and not acked.done():
+            acked.set_result(None)
+
+    def apply_resize(self):
+        while self._resize > 0:
+            self._resize -= 1
+            self.add_worker()
+
+        while self._resize < 0:
+            self._resize += 1
+            self.remove_worker()
+
+    def request_resize(self, delta):
+        self._resize += delta
+
+    async def run(self):
+        loop = self._loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGUSR1, self.request_resize, 1)
+        loop.add_signal_handler(signal.SIGUSR2, self.request_resize, -1)
+        threading.Thread(
+            target=self.read_acks, name="dispatcher-acks", daemon=True
+        ).start()
+
+        offset = None
+        logger.info("Dispatcher %s started", os.getpid())
+
+        async with Bot(settings.TELEGRAM_BOT_TOKEN) as bot:
+            await bot.delete_webhook()
+            try:
+                while True:
+                    self.check_workers()
+                    self.apply_resize()
+
+                    try:
+                        updates = await bot.get_updates(
+                            offset=offset,
+                            timeout=10,
+                            allowed_updates=Update.ALL_TYPES,
+                        )
+                    except TelegramError as exc:
+                        logger.warning("Failed to get updates: %s", exc)
+                        await asyncio.sleep(1)
+                        continue
+
+                    for update in updates:
+                        offset = update.update_id + 1
+                        self.route(update)
+            finally:
+                for node in list(self.workers):
+                    self.workers[node]["queue"].put((STOP, None))
+                await asyncio.gather(
+                    *self._stopping.values(),
+                    *(
+                        loop.run_in_executor(None, worker["process"].join)
+                        for worker in self.workers.values()
+                    ),
+                )
+                self.acks.put(None)
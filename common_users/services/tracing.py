@@ -0,0 +1,250 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# user_data key of the conversation id, used as the trace id of every
+# update of one booking conversation
+TRACE_ID_KEY = "trace_id"
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def new_trace_id():
+    return os.urandom(16).hex()
+
+
+def get_trace_id(context, new=False):
+    """returns conversation id of the user, starts a new one if asked"""
+    if new or TRACE_ID_KEY not in context.user_data:
+        context.user_data[TRACE_ID_KEY] = new_trace_id()
+    return context.user_data[TRACE_ID_KEY]
+
+
+def finish_conversation(context):
+    """the next update of the user starts a new trace"""
+    context.user_data.pop(TRACE_ID_KEY, None)
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span(object):
+    """Span"""
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "root",
+        "name",
+        "kind",
+        "attributes",
+        "status",
+        "start",
+        "end",
+        "children",
+        "exported",
+        "lock",
+    )
+
+    def __init__(self, trace_id, parent, name, kind, attributes):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.root = parent.root if parent else self
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.status = STATUS_OK
+        self.start = time.time_ns()
+        self.end = None
+
+        if parent is None:
+            # spans finished before the root are exported with it, DB
+            # spans finish in other threads
+            self.children = []
+            self.exported = False
+            self.lock = threading.Lock()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def as_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [
+                {"key": key, "value": otlp_value(value)}
+                for key, value in self.attributes.items()
+                if value is not None
+            ],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class JsonlExporter(object):
+    """
+    Appends finished spans to ``path``, one OTLP/JSON
+    ``ExportTraceServiceRequest`` per line.
+
+    Lines are written by a background thread so handlers never wait for
+    the disk.
+    """
+
+    def __init__(self, path, service_name):
+        self.path = path
+        self.resource = {
+            "attributes": [
+                {"key": "service.name", "value": otlp_value(service_name)}
+            ]
+        }
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        line = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": self.resource,
+                        "scopeSpans": [
+                            {
+                                "scope": {"name": __name__},
+                                "spans": [span.as_otlp() for span in spans],
+                            }
+                        ],
+                    }
+                ]
+            },
+            ensure_ascii=False,
+        )
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._write, name="bot-traces", daemon=True
+                )
+                self._thread.start()
+        self._queue.put(line)
+
+    def _write(self):
+        with open(self.path, "a", encoding="utf-8") as file:
+            while True:
+                line = self._queue.get()
+                if line is None:
+                    return
+
+                file.write(line + "\n")
+                if self._queue.empty():
+                    file.flush()
+
+    def shutdown(self):
+        """write the queued spans and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+class Tracer(object):
+    """Tracer"""
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    @contextlib.contextmanager
+    def span(self, name, kind=INTERNAL, trace_id=None, **attributes):
+        """
+        Child span of the current one, or a root span when ``trace_id`` is
+        given. Without either (or with tracing off) nothing is recorded.
+        """
+        parent = current_span.get()
+
+        if not self.enabled or (parent is None and trace_id is None):
+            yield None
+            return
+
+        span = Span(
+            trace_id or parent.trace_id,
+            None if trace_id else parent,
+            name,
+            kind,
+            attributes,
+        )
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.status = STATUS_ERROR
+            span.attributes["error"] = type(exc).__name__
+            raise
+        finally:
+            span.end = time.time_ns()
+            current_span.reset(token)
+            self._finish(span)
+
+    def _finish(self, span):
+        root = span.root
+
+        with root.lock:
+            if span is root:
+                spans, root.children = [*root.children, root], []
+                root.exported = True
+            elif root.exported:
+                # e.g. a message sent by a task the handler did not await
+                spans = [span]
+            else:
+                root.children.append(span)
+                return
+
+        self.exporter.export(spans)
+
+    def shutdown(self):
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+tracer = Tracer(
+    JsonlExporter(settings.BOT_TRACE_FILE, "telegram_bot")
+    if settings.BOT_TRACE_FILE
+    else None
+)
@@ -0,0 +1,36 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from common_users.services.catalog import catalog_cache
+from common_users.services.query_budget import record_queries
+from core.models.managers import soft_delete_changed
+from orders.intervals import reservation_index
+from orders.models import Category, Product, Reservation
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(soft_delete_changed, sender=Category)
+@receiver(soft_delete_changed, sender=Product)
+def invalidate_catalog(**kwargs):
+    """drop the catalog read model after catalog changes"""
+    catalog_cache.invalidate()
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+@receiver(soft_delete_changed, sender=Reservation)
+def invalidate_reservations(**kwargs):
+    """drop the reservation interval trees after reservation changes"""
+    reservation_index.invalidate()
+
+
+@receiver(connection_created)
+def install_query_recorder(connection, **kwargs):
+    """count the queries of every new connection per bot update"""
+    # the wrapper outlives its connection, reconnects must not add another
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
@@ -1,3 +1,307 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+from collections import defaultdict
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from common_users.management.commands.load_test import (
+    FIRST_TELEGRAM_ID,
+    SyntheticUser,
+)
+from common_users.management.commands.telegram_bot import build_application
+from common_users.models import (
+    BotConversation,
+    CommonUser,
+    CommonUserPurchase,
+)
+from common_users.services.application import ReloadableConversationHandler
+from common_users.services.bot_tools import (
+    create_purchase,
+    get_booking_end,
+    get_pending_expirations_queryset,
+    get_purchases_queryset,
+    get_user_products_queryset,
+    hold_cart_products,
+)
+from common_users.services.cart import Cart
+from common_users.services.catalog import catalog_cache
+from common_users.services.fake_bot_api import FakeBotApi
+from orders.intervals import reservation_index
+from orders.models import Category, Product, Reservation
+from services.telegram_ingest import UpdateConsumer
+
+# full table scans in EXPLAIN output of each backend
+SEQ_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"\bSCAN (\w+)(?: AS \w+)?\s*$", re.MULTILINE),
+}
+
+
+def seed(rows):
+    """create a data set shaped like production, returns one of each"""
+    now = timezone.now()
+    users = CommonUser.objects.bulk_create(
+        CommonUser(username=f"plans-{index}", telegram_user_id=f"{index}")
+        for index in range(max(rows // 10, 1))
+    )
+    categories = Category.objects.bulk_create(
+        Category(name=f"plans-{index}") for index in range(max(rows // 100, 1))
+    )
+    products = Product.objects.bulk_create(
+        Product(
+            name=f"plans-{index}",
+            category=categories[index % len(categories)],
+            # every fifth product is booked, half of them taken place
+            is_free=index % 5 != 0,
+            is_took_place=index % 10 == 0,
+            lessor=users[index % len(users)] if index % 5 == 0 else None,
+            expiration_date=(
+                now + timedelta(minutes=index % 60) if index % 5 == 0 else None
+            ),
+        )
+        for index in range(rows)
+    )
+    CommonUserPurchase.objects.bulk_create(
+        CommonUserPurchase(
+            user=users[index % len(users)],
+            product=product,
+            quantity=1,
+            amount=0,
+            is_completed=index % 3 != 0,
+        )
+        for index, product in enumerate(products)
+    )
+    Reservation.objects.bulk_create(
+        Reservation(
+            product=product,
+            lessor=users[index % len(users)],
+            start=now + timedelta(hours=index % 24),
+            end=now + timedelta(hours=index % 24 + 1),
+        )
+        for index, product in enumerate(products)
+    )
+    return users[0], categories[0], products[0]
+
+
+def get_queries(user, category, product):
+    """returns {name: queryset} of the hot bot_tools queries"""
+    now = timezone.now()
+    return {
+        "get_purchases": get_purchases_queryset(user.telegram_user_id),
+        "get_user_products": get_user_products_queryset(user.telegram_user_id),
+        "get_pending_expirations": get_pending_expirations_queryset(),
+        "deadlines resync": get_pending_expirations_queryset(
+            now - timedelta(seconds=30)
+        ),
+        "category products": Product.objects.free().filter(category=category),
+        "is_product_free": Reservation.objects.filter(
+            product=product, start__gt=now
+        ).overlapping(now, get_booking_end(now, 1)),
+    }
+
+
+class QueryPlanTests(TestCase):
+    """the hot bot_tools queries never scan a whole table"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.category, cls.product = seed(2000)
+
+    def setUp(self):
+        self.pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if self.pattern is None:
+            self.skipTest(f"{connection.vendor} is not supported")
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            if connection.vendor == "postgresql":
+                # tiny tables are cheaper to scan, only a missing index
+                # should leave the planner no other way
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def test_hot_queries_use_indexes(self):
+        queries = get_queries(self.user, self.category, self.product)
+
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(self.pattern.findall(plan), [], plan)
+
+
+class PaidHoldTests(TestCase):
+    """a paid invoice books the products held for it"""
+
+    def setUp(self):
+        category = Category.objects.create(name="paid")
+        self.product = Product.objects.create(name="paid-1", category=category)
+        CommonUser.objects.create(username="paid-1", telegram_user_id="1")
+        self.context = SimpleNamespace(user_data={"telegram_user_id": "1"})
+        Cart(self.context).add(self.product)
+
+    def test_hold_missing_from_user_data_is_booked(self):
+        payload = hold_cart_products.func(self.context)["payload"]
+        # e.g. lost with the unflushed user data of a restarted process
+        self.context.user_data[settings.HOLDS_SESSION_ID] = {}
+
+        result = create_purchase.func(self.context, payload)
+
+        self.assertEqual(result["reserved"], [self.product.name])
+        self.product.refresh_from_db()
+        self.assertIsNone(self.product.hold_token)
+        self.assertEqual(len(Cart(self.context)), 0)
+
+
+@override_settings(TELEGRAM_BOT_TOKEN="1:test")
+class IngestFailoverTests(TransactionTestCase):
+    """a new ingest leader drops user state cached in an earlier term"""
+
+    async def take_over(self):
+        application = build_application(webhook=True)
+        handler = next(
+            handler
+            for handlers in application.handlers.values()
+            for handler in handlers
+            if isinstance(handler, ReloadableConversationHandler)
+        )
+        await handler._initialize_persistence(application)
+        handler.reload_states({(1,): 1, (2,): 2})
+        user_data = {"telegram_user_id": "1"}
+        await application.persistence.refresh_user_data(1, user_data)
+
+        # meanwhile another instance moved the conversation of user 1 on
+        # and ended the one of user 2
+        await asyncio.to_thread(
+            BotConversation.objects.create,
+            name=handler.name,
+            key=json.dumps((1,)),
+            state=3,
+        )
+
+        consumer = UpdateConsumer(application)
+        self.assertTrue(await consumer.renew_lease())
+
+        return handler, user_data, application.persistence
+
+    def test_state_is_reloaded_on_takeover(self):
+        handler, user_data, persistence = asyncio.run(self.take_over())
+
+        self.assertEqual(dict(handler._conversations), {(1,): 3})
+        self.assertEqual(user_data, {})
+        self.assertEqual(persistence._sessions, {})
+
+
+@override_settings(
+    TELEGRAM_BOT_TOKEN="1:test",
+    BOT_RATE_LIMIT=1000,
+    BOT_CHAT_RATE_LIMIT=1000,
+    BOT_CHAT_RATE_BURST=1000,
+)
+class FunnelTestCase(TransactionTestCase):
+    """runs the bot against the fake Bot API, the ORM calls use threads"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name="funnel")
+        self.product = Product.objects.create(
+            name="funnel-1", category=self.category
+        )
+        # module level caches outlive the flushed tables of other tests
+        catalog_cache.invalidate()
+        reservation_index.invalidate()
+
+    async def run_user(self):
+        api = FakeBotApi()
+        await api.start()
+        user = SyntheticUser(api, FIRST_TELEGRAM_ID, 10, 0, defaultdict(list))
+        application = build_application(base_url=api.base_url)
+        try:
+            async with application:
+                await application.updater.start_polling(poll_interval=0)
+                await application.start()
+                try:
+                    return user, await user.run(self.category.name)
+                finally:
+                    await application.updater.stop()
+                    await application.stop()
+        finally:
+            await api.stop()
+
+    def walk(self):
+        """
+        walk one synthetic user through the funnel, returns the user, its
+        outcome and the query stats logged for every handler call
+        """
+        with self.assertLogs(
+            "common_users.services.query_budget", "INFO"
+        ) as logs:
+            user, outcome = asyncio.run(self.run_user())
+
+        # over budget warnings repeat the stats of their call
+        records = [
+            record.query_stats
+            for record in logs.records
+            if hasattr(record, "query_stats") and record.levelname == "INFO"
+        ]
+        return user, outcome, records
+
+
+class QueryBudgetTests(FunnelTestCase):
+    """handlers of the booking funnel stay within their query budgets"""
+
+    def test_funnel_handlers_stay_within_budget(self):
+        user, outcome, records = self.walk()
+        self.assertEqual(outcome, "booked")
+
+        budgeted = [record for record in records if record["budget"]]
+        self.assertIn(
+            "successful_payment_callback",
+            {record["handler"] for record in budgeted},
+        )
+        for record in budgeted:
+            with self.subTest(record["handler"], state=record["state"]):
+                self.assertLessEqual(
+                    record["queries"], record["budget"], record["slowest_sql"]
+                )
+
+
+class LoadTestSmokeTests(FunnelTestCase):
+    """the load test tooling books a spot end to end"""
+
+    def test_synthetic_user_books_a_product(self):
+        user, outcome, records = self.walk()
+
+        self.assertEqual(outcome, "booked")
+        self.assertEqual(user.booked, [self.product.name])
+        self.product.refresh_from_db()
+        self.assertEqual(
+            self.product.lessor.telegram_user_id, str(FIRST_TELEGRAM_ID)
+        )
+        self.assertIsNone(self.product.hold_token)
+        self.assertEqual(
+            Reservation.objects.filter(product=self.product).count(), 1
+        )
+        self.assertEqual(
+            CommonUserPurchase.objects.filter(product=self.product).count(), 1
+        )
+
+    def test_load_test_command(self):
+        stdout = StringIO()
+        call_command(
+            "load_test",
+            users=1,
+            products=1,
+            ramp=0,
+            think=0,
+            timeout=10,
+            stdout=stdout,
+        )
+
+        self.assertIn("outcomes: booked 1", stdout.getvalue())
+        self.assertIn("1 products booked, 0 booked twice", stdout.getvalue())
@@ -0,0 +1,46 @@
+import threading
+import time
+
+
+class TTLCache(object):
+    """
+    Value built by ``_load`` and kept for at most ``ttl`` seconds.
+
+    ``invalidate`` drops the value, the next ``_get`` builds it again. The
+    load runs outside the lock, so a load started before an invalidation
+    is returned to its caller but not stored.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_at = 0
+        # bumped by invalidate(), a load started before it is not stored
+        self._generation = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+            self._generation += 1
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _get(self):
+        with self._lock:
+            if (
+                self._value is not None
+                and time.monotonic() - self._loaded_at < self.ttl
+            ):
+                return self._value
+            generation = self._generation
+
+        started = time.monotonic()
+        value = self._load()
+
+        with self._lock:
+            if generation == self._generation:
+                self._value = value
+                self._loaded_at = started
+        return value
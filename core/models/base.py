@@ -1,8 +1,58 @@
+import os
+import threading
+import time
 import uuid
 
+from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from core.models.managers import AllObjectsManager, SoftDeleteManager
+
+
+_uuid7_lock = threading.Lock()
+_uuid7_last = [0, 0]
+
+
+def uuid7():
+    """
+    Time-ordered UUID (RFC 9562 version 7).
+
+    The first 48 bits are the unix time in milliseconds, so new keys are
+    appended to the end of the primary key index. Within one millisecond
+    the 12 bit ``rand_a`` field is a counter started at a random value,
+    which keeps keys made by this process strictly increasing.
+    """
+    with _uuid7_lock:
+        timestamp = time.time_ns() // 1_000_000
+        last_timestamp, counter = _uuid7_last
+
+        if timestamp > last_timestamp:
+            # the upper half is left free for the counter to grow
+            counter = int.from_bytes(os.urandom(2), "big") & 0x7FF
+        else:
+            timestamp, counter = last_timestamp, counter + 1
+            if counter > 0xFFF:
+                timestamp, counter = timestamp + 1, 0
+
+        _uuid7_last[:] = timestamp, counter
+
+    random_bits = int.from_bytes(os.urandom(8), "big") & (1 << 62) - 1
+    return uuid.UUID(
+        int=timestamp << 80
+        | 0x7 << 76
+        | counter << 64
+        | 0b10 << 62
+        | random_bits
+    )
+
+
+def generate_uuid():
+    """new primary key of the settings.UUID_VERSION version"""
+    if settings.UUID_VERSION == 7:
+        return uuid7()
+    return uuid.uuid4()
+
 
 class BaseModel(models.Model):
     """BaseModel"""
@@ -11,6 +61,9 @@ class BaseModel(models.Model):
     updated = models.DateTimeField(auto_now=True)
     is_deleted = models.BooleanField(default=False)
 
+    objects = SoftDeleteManager()
+    all_objects = AllObjectsManager()
+
     class Meta:
         abstract = True
 
@@ -20,7 +73,7 @@ class BaseUUIDModel(BaseModel):
 
     id = models.UUIDField(
         primary_key=True,
-        default=uuid.uuid4,
+        default=generate_uuid,
         editable=False,
         unique=True,
     )
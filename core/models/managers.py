@@ -0,0 +1,43 @@
+from django.db import models
+from django.dispatch import Signal
+from django.utils import timezone
+
+# sent with the model as sender and the affected pks after a bulk
+# soft_delete or restore, which send no post_save
+soft_delete_changed = Signal()
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    """SoftDeleteQuerySet"""
+
+    def _set_deleted(self, is_deleted):
+        pks = list(
+            self.filter(is_deleted=not is_deleted).values_list("pk", flat=True)
+        )
+        if not pks:
+            return 0
+
+        updated = self.model.all_objects.filter(pk__in=pks).update(
+            is_deleted=is_deleted, updated=timezone.now()
+        )
+        soft_delete_changed.send(sender=self.model, pks=pks)
+        return updated
+
+    def soft_delete(self):
+        """mark rows deleted with one UPDATE, returns their number"""
+        return self._set_deleted(True)
+
+    def restore(self):
+        """bring soft deleted rows back with one UPDATE"""
+        return self._set_deleted(False)
+
+
+class AllObjectsManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """Manager of live and soft deleted rows"""
+
+
+class SoftDeleteManager(AllObjectsManager):
+    """Manager of live rows only"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
@@ -1,6 +1,16 @@
 from django.contrib import admin
 
-from orders.models import Category, Product
+from orders.models import Category, JobLease, Product, Reservation
 
 admin.site.register(Category)
 admin.site.register(Product)
+
+
+@admin.register(JobLease)
+class JobLeaseAdmin(admin.ModelAdmin):
+    list_display = ["name", "holder", "expires_at"]
+
+
+@admin.register(Reservation)
+class ReservationAdmin(admin.ModelAdmin):
+    list_display = ["product", "lessor", "start", "end"]
@@ -0,0 +1,113 @@
+from collections import defaultdict
+from operator import itemgetter
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.cache import TTLCache
+
+
+class IntervalTree(object):
+    """
+    Static augmented interval tree of ``(start, end, value)`` triples.
+
+    Intervals are sorted by start and laid out as an implicit balanced
+    binary tree, every node keeps the greatest end of its subtree. An
+    overlap query visits O(log n + k) nodes for k matches.
+    """
+
+    def __init__(self, intervals):
+        self._intervals = sorted(intervals, key=itemgetter(0))
+        self._max_end = [None] * len(self._intervals)
+
+        if self._intervals:
+            self._build(0, len(self._intervals) - 1)
+
+    def _build(self, low, high):
+        middle = (low + high) // 2
+        end = self._intervals[middle][1]
+
+        if low < middle:
+            end = max(end, self._build(low, middle - 1))
+        if middle < high:
+            end = max(end, self._build(middle + 1, high))
+
+        self._max_end[middle] = end
+        return end
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def overlap(self, start, end):
+        """returns values of intervals overlapping [start, end)"""
+        found = []
+        stack = [(0, len(self._intervals) - 1)]
+
+        while stack:
+            low, high = stack.pop()
+            if low > high:
+                continue
+
+            middle = (low + high) // 2
+            # nothing in this subtree ends after start
+            if self._max_end[middle] <= start:
+                continue
+
+            stack.append((low, middle - 1))
+
+            interval_start, interval_end, value = self._intervals[middle]
+            # intervals on the right start even later
+            if interval_start < end:
+                if interval_end > start:
+                    found.append(value)
+                stack.append((middle + 1, high))
+
+        return found
+
+
+class ReservationIndex(TTLCache):
+    """
+    In-process interval trees of current and future reservations per
+    category.
+
+    Backs ``ReservationManager.busy_product_ids`` on databases without
+    range types. It is rebuilt on the first query after ``invalidate`` and
+    at most ``ttl`` seconds after the previous build.
+    """
+
+    def _load(self):
+        from orders.models import Reservation
+
+        intervals = defaultdict(list)
+
+        for reservation in Reservation.objects.filter(
+            end__gt=timezone.now()
+        ).values("product_id", "product__category_id", "start", "end"):
+            intervals[str(reservation["product__category_id"])].append(
+                (
+                    reservation["start"],
+                    reservation["end"],
+                    (reservation["start"], str(reservation["product_id"])),
+                )
+            )
+
+        return {
+            category_id: IntervalTree(category_intervals)
+            for category_id, category_intervals in intervals.items()
+        }
+
+    def busy_product_ids(self, category_id, start, end):
+        """returns ids of products whose reservation starts in (start, end)"""
+        tree = self._get().get(str(category_id))
+
+        if tree is None:
+            return set()
+        # the current booking is judged by the product expiration date
+        return {
+            product_id
+            for reservation_start, product_id in tree.overlap(start, end)
+            if reservation_start > start
+        }
+
+
+reservation_index = ReservationIndex(settings.CATALOG_CACHE_TTL)
@@ -0,0 +1,320 @@
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models.managers import SoftDeleteManager, SoftDeleteQuerySet
+
+
+RELEASE_EXPIRED_SQL = """
+    WITH expired AS (
+        SELECT id, lessor_id, hold_token
+        FROM order_products
+        WHERE id = ANY(%s::uuid[])
+            AND is_deleted = false
+            AND is_free = false
+            AND expiration_date <= %s
+        FOR UPDATE
+    )
+    UPDATE order_products AS product
+    SET is_free = true,
+        is_took_place = false,
+        lessor_id = NULL,
+        expiration_date = NULL,
+        hold_token = NULL,
+        updated = %s
+    FROM expired
+    LEFT JOIN common_users AS lessor ON lessor.id = expired.lessor_id
+    WHERE product.id = expired.id
+    RETURNING product.id, product.name, lessor.telegram_user_id,
+        expired.hold_token IS NOT NULL
+"""
+
+
+RESERVE_SQL = """
+    UPDATE order_products
+    SET is_free = false,
+        is_took_place = false,
+        lessor_id = %s,
+        expiration_date = %s,
+        hold_token = %s,
+        updated = %s
+    WHERE id = ANY(%s::uuid[])
+        AND is_deleted = false
+        AND (
+            is_free = true
+            OR expiration_date < %s
+            OR (hold_token IS NOT NULL AND lessor_id = %s)
+        )
+    RETURNING id
+"""
+
+
+RESERVE_HELD_SQL = """
+    UPDATE order_products
+    SET is_free = false,
+        is_took_place = false,
+        lessor_id = %s,
+        expiration_date = %s,
+        hold_token = NULL,
+        updated = %s
+    WHERE id = ANY(%s::uuid[])
+        AND is_deleted = false
+        AND hold_token = %s
+        AND lessor_id = %s
+    RETURNING id
+"""
+
+
+EXTEND_HOLD_SQL = """
+    WITH held AS (
+        SELECT id
+        FROM order_products
+        WHERE hold_token = %s
+            AND is_deleted = false
+            AND expiration_date > %s
+        FOR UPDATE
+    )
+    UPDATE order_products
+    SET expiration_date = %s,
+        updated = %s
+    WHERE id IN (SELECT id FROM held)
+        AND (SELECT count(*) FROM held) = %s
+    RETURNING id
+"""
+
+
+BUSY_PRODUCTS_SQL = """
+    SELECT DISTINCT reservation.product_id
+    FROM order_reservations AS reservation
+    JOIN order_products AS product ON product.id = reservation.product_id
+    WHERE product.category_id = %s
+        AND product.is_deleted = false
+        AND reservation.is_deleted = false
+        AND reservation.start > %s
+        AND tstzrange(reservation.start, reservation."end", '[)')
+            && tstzrange(%s, %s, '[)')
+"""
+
+
+def free_products_q(prefix=""):
+    """
+    Q object matching free products.
+
+    A booked product whose expiration date has passed is free even if the
+    cleanup job has not flipped ``is_free`` back yet.
+    """
+    return Q(**{f"{prefix}is_free": True}) | Q(
+        **{f"{prefix}expiration_date__lt": timezone.now()}
+    )
+
+
+class ProductQuerySet(SoftDeleteQuerySet):
+    """ProductQuerySet"""
+
+    def free(self):
+        return self.filter(free_products_q())
+
+    def booked(self):
+        return self.exclude(free_products_q())
+
+
+class ProductManager(SoftDeleteManager.from_queryset(ProductQuerySet)):
+    """ProductManager"""
+
+    def release_expired(self, product_ids):
+        """
+        Free expired products among ``product_ids``.
+
+        Returns dicts with the released product id, name, the telegram
+        user id of the former lessor and whether it was only held. On
+        Postgres this is a single UPDATE ... RETURNING statement.
+        """
+        now = timezone.now()
+        product_ids = [str(product_id) for product_id in product_ids]
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(RELEASE_EXPIRED_SQL, [product_ids, now, now])
+                return [
+                    {
+                        "id": row[0],
+                        "name": row[1],
+                        "telegram_user_id": row[2],
+                        "is_hold": row[3],
+                    }
+                    for row in cursor.fetchall()
+                ]
+
+        with transaction.atomic():
+            expired = self.select_for_update().filter(
+                id__in=product_ids, is_free=False, expiration_date__lte=now
+            )
+            released = list(
+                expired.values(
+                    "id",
+                    "name",
+                    telegram_user_id=F("lessor__telegram_user_id"),
+                    is_hold=Q(hold_token__isnull=False),
+                )
+            )
+            self.filter(id__in=[product["id"] for product in released]).update(
+                is_free=True,
+                is_took_place=False,
+                lessor=None,
+                expiration_date=None,
+                hold_token=None,
+            )
+        return released
+
+    def reserve(
+        self,
+        product_ids,
+        lessor,
+        expiration_date,
+        hold_token=None,
+        held_with=None,
+    ):
+        """
+        Book the free products among ``product_ids`` for ``lessor``.
+
+        Products held for ``lessor`` count as free. With ``hold_token`` the
+        products are only held until ``expiration_date``. With
+        ``held_with`` only the products still held for ``lessor`` under
+        that token are booked, so a paid invoice books exactly its hold.
+
+        Returns ids of the claimed products, the others were taken by
+        someone else. The check and the claim are one conditional UPDATE,
+        so concurrent reservations only wait on each other's row locks and
+        a product is never claimed twice.
+        """
+        now = timezone.now()
+        product_ids = [str(product_id) for product_id in product_ids]
+
+        if not product_ids:
+            return []
+
+        if connection.vendor == "postgresql" and held_with is not None:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    RESERVE_HELD_SQL,
+                    [
+                        lessor.id,
+                        expiration_date,
+                        now,
+                        product_ids,
+                        held_with,
+                        lessor.id,
+                    ],
+                )
+                return [row[0] for row in cursor.fetchall()]
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    RESERVE_SQL,
+                    [
+                        lessor.id,
+                        expiration_date,
+                        hold_token,
+                        now,
+                        product_ids,
+                        now,
+                        lessor.id,
+                    ],
+                )
+                return [row[0] for row in cursor.fetchall()]
+
+        if held_with is not None:
+            claimable = Q(hold_token=held_with, lessor=lessor)
+        else:
+            claimable = free_products_q() | Q(
+                hold_token__isnull=False, lessor=lessor
+            )
+
+        with transaction.atomic():
+            self.filter(claimable, id__in=product_ids).update(
+                is_free=False,
+                is_took_place=False,
+                lessor=lessor,
+                expiration_date=expiration_date,
+                hold_token=hold_token,
+                updated=now,
+            )
+            # the write lock is held until commit, so only the rows
+            # claimed by the update above carry this exact stamp
+            return list(
+                self.filter(
+                    id__in=product_ids, lessor=lessor, updated=now
+                ).values_list("id", flat=True)
+            )
+
+    def extend_hold(self, hold_token, count, expiration_date):
+        """
+        Move the expiration of the ``count`` products still held with
+        ``hold_token`` to ``expiration_date``, returns their ids. Nothing
+        is extended when some of them were lost.
+        """
+        now = timezone.now()
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    EXTEND_HOLD_SQL,
+                    [hold_token, now, expiration_date, now, count],
+                )
+                return [row[0] for row in cursor.fetchall()]
+
+        with transaction.atomic():
+            held = list(
+                self.select_for_update()
+                .filter(hold_token=hold_token, expiration_date__gt=now)
+                .values_list("id", flat=True)
+            )
+            if len(held) != count:
+                return []
+
+            self.filter(id__in=held).update(
+                expiration_date=expiration_date, updated=now
+            )
+        return held
+
+
+class ReservationQuerySet(SoftDeleteQuerySet):
+    """ReservationQuerySet"""
+
+    def overlapping(self, start, end):
+        """reservations intersecting [start, end)"""
+        return self.filter(start__lt=end, end__gt=start)
+
+
+class ReservationManager(SoftDeleteManager.from_queryset(ReservationQuerySet)):
+    """ReservationManager"""
+
+    def busy_product_ids(self, category_id, start, end):
+        """
+        Returns ids of category products with a later reservation
+        starting within (start, end). The current booking of a spot is
+        left to ``free_products_q``, so an expired one frees the spot
+        before its reservation is trimmed.
+
+        Postgres answers it from the GiST index of the reservation
+        exclusion constraint, other databases from in-memory interval
+        trees.
+        """
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    BUSY_PRODUCTS_SQL, [category_id, start, start, end]
+                )
+                return {str(row[0]) for row in cursor.fetchall()}
+
+        from orders.intervals import reservation_index
+
+        return reservation_index.busy_product_ids(category_id, start, end)
+
+    def release(self, product_ids, now=None):
+        """end the current reservations of released products now"""
+        now = now or timezone.now()
+        return self.filter(
+            product_id__in=product_ids, start__lt=now, end__gt=now
+        ).update(end=now)
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0004_remove_product_expiration_time_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobLease",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, db_index=True),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("is_deleted", models.BooleanField(default=False)),
+                (
+                    "name",
+                    models.CharField(
+                        max_length=50, unique=True, verbose_name="Name"
+                    ),
+                ),
+                (
+                    "holder",
+                    models.CharField(max_length=255, verbose_name="Holder"),
+                ),
+                (
+                    "expires_at",
+                    models.DateTimeField(verbose_name="Expires at"),
+                ),
+            ],
+            options={
+                "verbose_name": "Job lease",
+                "verbose_name_plural": "Job leases",
+                "db_table": "order_job_leases",
+            },
+        ),
+    ]
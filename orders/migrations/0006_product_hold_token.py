@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0005_job_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="hold_token",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                max_length=32,
+                null=True,
+                verbose_name="Hold token",
+            ),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+EXCLUSION_SQL = """
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+    ALTER TABLE order_reservations
+        ADD CONSTRAINT order_reservations_no_overlap
+        EXCLUDE USING gist (
+            product_id WITH =,
+            tstzrange(start, "end", '[)') WITH &&
+        );
+"""
+
+
+def add_exclusion_constraint(apps, schema_editor):
+    # SQLite has no range types, overlaps are checked by the application
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(EXCLUSION_SQL)
+
+
+def remove_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "ALTER TABLE order_reservations "
+            "DROP CONSTRAINT order_reservations_no_overlap"
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("orders", "0006_product_hold_token"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Reservation",
+            fields=[
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, db_index=True),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("is_deleted", models.BooleanField(default=False)),
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+                ("start", models.DateTimeField(verbose_name="Start")),
+                ("end", models.DateTimeField(verbose_name="End")),
+                (
+                    "lessor",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="reservations",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Lessor",
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reservations",
+                        to="orders.product",
+                        verbose_name="Product",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Reservation",
+                "verbose_name_plural": "Reservations",
+                "db_table": "order_reservations",
+                "indexes": [
+                    models.Index(
+                        fields=["product", "start", "end"],
+                        name="order_reservations_slot_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="reservation",
+            constraint=models.CheckConstraint(
+                check=models.Q(("end__gt", models.F("start"))),
+                name="order_reservations_end_after_start",
+            ),
+        ),
+        migrations.RunPython(
+            add_exclusion_constraint, remove_exclusion_constraint
+        ),
+    ]
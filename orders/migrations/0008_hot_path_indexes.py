@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0007_reservation"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "is_free"], name="order_products_free_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_free", False)),
+                fields=["expiration_date", "lessor"],
+                name="order_products_booked_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_took_place", True)),
+                fields=["lessor", "expiration_date"],
+                name="order_products_took_place_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 4.2.6 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+EXCLUSION_SQL = """
+    ALTER TABLE order_reservations
+        DROP CONSTRAINT order_reservations_no_overlap;
+    ALTER TABLE order_reservations
+        ADD CONSTRAINT order_reservations_no_overlap
+        EXCLUDE USING gist (
+            product_id WITH =,
+            tstzrange(start, "end", '[)') WITH &&
+        ){where};
+"""
+
+
+def exclude_live_reservations(apps, schema_editor):
+    # soft deleted reservations no longer block their slot
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            EXCLUSION_SQL.format(where=" WHERE (is_deleted = false)")
+        )
+
+
+def exclude_all_reservations(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(EXCLUSION_SQL.format(where=""))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0009_uuid7_ids"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="product",
+            name="order_products_free_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="product",
+            name="order_products_booked_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="product",
+            name="order_products_took_place_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="reservation",
+            name="order_reservations_slot_idx",
+        ),
+        migrations.AddIndex(
+            model_name="category",
+            index=models.Index(
+                condition=models.Q(("is_active", True), ("is_deleted", False)),
+                fields=["name"],
+                name="order_categories_live_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False)),
+                fields=["category", "is_free"],
+                name="order_products_free_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False), ("is_free", False)),
+                fields=["expiration_date", "lessor"],
+                name="order_products_booked_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(
+                    ("is_deleted", False), ("is_took_place", True)
+                ),
+                fields=["lessor", "expiration_date"],
+                name="order_products_took_place_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="reservation",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False)),
+                fields=["product", "start", "end"],
+                name="order_reservations_slot_idx",
+            ),
+        ),
+        migrations.RunPython(
+            exclude_live_reservations, exclude_all_reservations
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0010_soft_delete"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="category",
+            name="name",
+            field=models.CharField(max_length=50, verbose_name="Name"),
+        ),
+        migrations.AddConstraint(
+            model_name="category",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_deleted", False)),
+                fields=("name",),
+                name="order_categories_live_name_uniq",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders", "0011_category_live_name_unique"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False), ("is_free", False)),
+                fields=["updated"],
+                name="order_products_booked_upd_idx",
+            ),
+        ),
+    ]
@@ -5,18 +5,36 @@ from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from core.models.base import BaseNameModel
+from core.models.base import BaseModel, BaseNameModel, BaseUUIDModel
+from orders.managers import ProductManager, ReservationManager
 
 
 class Category(BaseNameModel):
     """Category"""
 
+    # unique among live categories only, see Meta.constraints
+    name = models.CharField(verbose_name=_("Name"), max_length=50)
     is_active = models.BooleanField(verbose_name=_("Is active"), default=True)
 
     class Meta:
         verbose_name = _("Category")
         verbose_name_plural = _("Categories")
         db_table = "order_categories"
+        constraints = [
+            # the name of a soft deleted category can be reused
+            models.UniqueConstraint(
+                fields=["name"],
+                name="order_categories_live_name_uniq",
+                condition=models.Q(is_deleted=False),
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["name"],
+                name="order_categories_live_idx",
+                condition=models.Q(is_active=True, is_deleted=False),
+            ),
+        ]
 
 
 class Product(BaseNameModel):
@@ -42,6 +60,25 @@ class Product(BaseNameModel):
         blank=True,
     )
     expiration_date = models.DateTimeField(null=True, blank=True)
+    # set while the product is held for an unpaid invoice
+    hold_token = models.CharField(
+        verbose_name=_("Hold token"),
+        max_length=32,
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+
+    objects = ProductManager()
+
+    @property
+    def is_available(self):
+        if self.is_free:
+            return True
+        return (
+            self.expiration_date is not None
+            and self.expiration_date < timezone.now()
+        )
 
     @property
     def str_expiration_date(self):
@@ -60,3 +97,89 @@ class Product(BaseNameModel):
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
         db_table = "order_products"
+        indexes = [
+            models.Index(
+                fields=["category", "is_free"],
+                name="order_products_free_idx",
+                condition=models.Q(is_deleted=False),
+            ),
+            # expiry sweep and reminders only look at booked products
+            models.Index(
+                fields=["expiration_date", "lessor"],
+                name="order_products_booked_idx",
+                condition=models.Q(is_free=False, is_deleted=False),
+            ),
+            # deadlines resync of the lease holder
+            models.Index(
+                fields=["updated"],
+                name="order_products_booked_upd_idx",
+                condition=models.Q(is_free=False, is_deleted=False),
+            ),
+            models.Index(
+                fields=["lessor", "expiration_date"],
+                name="order_products_took_place_idx",
+                condition=models.Q(is_took_place=True, is_deleted=False),
+            ),
+        ]
+
+
+class Reservation(BaseUUIDModel):
+    """Reservation"""
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name=_("Product"),
+        related_name="reservations",
+    )
+    lessor = models.ForeignKey(
+        "common_users.CommonUser",
+        on_delete=models.SET_NULL,
+        verbose_name=_("Lessor"),
+        related_name="reservations",
+        null=True,
+        blank=True,
+    )
+    start = models.DateTimeField(verbose_name=_("Start"))
+    end = models.DateTimeField(verbose_name=_("End"))
+
+    objects = ReservationManager()
+
+    class Meta:
+        verbose_name = _("Reservation")
+        verbose_name_plural = _("Reservations")
+        db_table = "order_reservations"
+        indexes = [
+            models.Index(
+                fields=["product", "start", "end"],
+                name="order_reservations_slot_idx",
+                condition=models.Q(is_deleted=False),
+            ),
+        ]
+        constraints = [
+            # overlapping slots are excluded by a Postgres-only constraint
+            # added in the migration
+            models.CheckConstraint(
+                check=models.Q(end__gt=models.F("start")),
+                name="order_reservations_end_after_start",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product}: {self.start} - {self.end}"
+
+
+class JobLease(BaseModel):
+    """JobLease"""
+
+    name = models.CharField(verbose_name=_("Name"), unique=True, max_length=50)
+    holder = models.CharField(verbose_name=_("Holder"), max_length=255)
+    expires_at = models.DateTimeField(verbose_name=_("Expires at"))
+
+    class Meta:
+        verbose_name = _("Job lease")
+        verbose_name_plural = _("Job leases")
+        db_table = "order_job_leases"
+
+    def __str__(self):
+        return f"{self.name}: {self.holder}"
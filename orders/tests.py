@@ -1 +1,144 @@
-# Create your tests here.
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from common_users.models import CommonUser
+from common_users.services.bot_tools import get_products, is_product_free
+from common_users.services.catalog import catalog_cache
+from orders.intervals import reservation_index
+from orders.models import Category, Product, Reservation
+
+THREADS = 8
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    """reservations racing for the same products from several threads"""
+
+    def setUp(self):
+        category = Category.objects.create(name="concurrent")
+        self.product_ids = [
+            str(
+                Product.objects.create(
+                    name=f"concurrent-{index}", category=category
+                ).id
+            )
+            for index in range(5)
+        ]
+        self.users = [
+            CommonUser.objects.create(
+                username=f"concurrent-{index}",
+                telegram_user_id=f"concurrent-{index}",
+            )
+            for index in range(THREADS)
+        ]
+
+    def reserve_all(self, user, barrier, claims, errors):
+        try:
+            barrier.wait()
+            expiration_date = timezone.now() + timedelta(minutes=5)
+
+            while True:
+                try:
+                    ids = Product.objects.reserve(
+                        self.product_ids, user, expiration_date
+                    )
+                    break
+                except OperationalError:
+                    # SQLite reports lock timeouts instead of waiting
+                    time.sleep(0.01)
+
+            claims[str(user.id)] = [str(product_id) for product_id in ids]
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_no_product_is_booked_twice(self):
+        barrier = threading.Barrier(THREADS)
+        claims = {}
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self.reserve_all,
+                args=(user, barrier, claims, errors),
+            )
+            for user in self.users
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        claimed = Counter(
+            product_id for ids in claims.values() for product_id in ids
+        )
+        self.assertEqual(sorted(claimed), sorted(self.product_ids))
+        self.assertEqual(set(claimed.values()), {1})
+
+        lessors = {
+            str(product_id): str(lessor_id)
+            for product_id, lessor_id in Product.objects.filter(
+                id__in=self.product_ids
+            ).values_list("id", "lessor_id")
+        }
+        owners = {
+            product_id: user_id
+            for user_id, ids in claims.items()
+            for product_id in ids
+        }
+        self.assertEqual(lessors, owners)
+
+
+class BusyProductTests(TestCase):
+    """spots hidden from the product list by their reservations"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name="busy")
+        self.product = Product.objects.create(
+            name="busy-1", category=self.category
+        )
+        self.user = CommonUser.objects.create(
+            username="busy-1", telegram_user_id="busy-1"
+        )
+        catalog_cache.invalidate()
+        reservation_index.invalidate()
+
+    def get_product_ids(self):
+        page = get_products.func(self.category.id)
+        return [str(product.id) for product in page["items"]]
+
+    def test_expired_booking_is_listed_before_it_is_released(self):
+        now = timezone.now()
+        # the arrival deadline passed, the cleanup job did not run yet
+        Product.objects.filter(id=self.product.id).update(
+            is_free=False,
+            lessor=self.user,
+            expiration_date=now - timedelta(minutes=1),
+        )
+        Reservation.objects.create(
+            product=self.product,
+            lessor=self.user,
+            start=now - timedelta(minutes=31),
+            end=now + timedelta(hours=1),
+        )
+
+        self.assertTrue(is_product_free.func(self.product.id, 1))
+        self.assertEqual(self.get_product_ids(), [str(self.product.id)])
+
+    def test_later_reservation_hides_the_product(self):
+        now = timezone.now()
+        Reservation.objects.create(
+            product=self.product,
+            lessor=self.user,
+            start=now + timedelta(minutes=30),
+            end=now + timedelta(hours=2),
+        )
+
+        self.assertFalse(is_product_free.func(self.product.id, 1))
+        self.assertEqual(self.get_product_ids(), [])
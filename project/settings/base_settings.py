@@ -93,6 +93,8 @@ DATABASES = {
         "PASSWORD": os.getenv("DATABASE_PASSWORD", "password"),
         "HOST": os.getenv("DATABASE_HOST", "localhost"),
         "PORT": os.getenv("DATABASE_PORT", 5432),
+        "CONN_MAX_AGE": int(os.getenv("DATABASE_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
@@ -136,6 +138,20 @@ USE_TZ = True
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 BASE_URL = "https://be45-37-99-32-160.ngrok-free.app"
 
+# webhook mode runs the bot inside the ASGI app instead of run_polling
+TELEGRAM_WEBHOOK_ENABLED = os.getenv("TELEGRAM_WEBHOOK_ENABLED") == "1"
+TELEGRAM_WEBHOOK_URL = f"{BASE_URL}/api/user/webhooks/"
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+
+# durable webhook ingest queue
+TELEGRAM_SEEN_UPDATES = 10000
+TELEGRAM_UPDATES_RETENTION = 24  # hours
+TELEGRAM_INGEST_BATCH_SIZE = 100
+TELEGRAM_INGEST_CONCURRENCY = 32
+TELEGRAM_INGEST_POLL_INTERVAL = 0.5  # seconds
+TELEGRAM_INGEST_LEASE_TTL = 30  # seconds
+TELEGRAM_INGEST_STATS_INTERVAL = 10  # seconds between queue metrics reads
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.1/howto/static-files/
 STATIC_URL = "/static/"
@@ -171,13 +187,78 @@ SWAGGER_SETTINGS = {
 }
 
 BASE_PAGINATE_BY = 2
+# page size of product and booking lists in the bot
+LIST_PAGINATE_BY = 10
 
 CART_SESSION_ID = "cart"
+# user data key of the cart items held for unpaid invoices, by hold token
+HOLDS_SESSION_ID = "holds"
 BASE_PRICE = 100
 
+# version of new primary keys, 7 is time-ordered and 4 is random
+UUID_VERSION = int(os.getenv("UUID_VERSION", 7))
+
 BASE_PATTERN = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
 
+# callback data of keyset page buttons, "next:<uuid>" or "prev:<uuid>"
+PAGE_PATTERN = r"^(next|prev):[0-9a-fA-F-]{36}$"
+
 PAYMENT_TOKEN = os.getenv("PAYMENT_TOKEN")
 
 START_MINUTE = 30
+# seconds cart products stay held between the invoice and the payment
+PAYMENT_HOLD_TTL = 600
 END_MINUTE = 15
+
+# seconds to delay the release of expired bookings so the writes are batched,
+# availability itself is computed at read time
+EXPIRY_CLEANUP_DELAY = 60
+
+# seconds a bot instance holds the maintenance jobs lease without renewing it
+JOB_LEASE_TTL = 30
+# seconds a deadlines resync of the lease holder reaches back before the
+# previous one, covers late commits and clock skew between instances
+EXPIRY_SYNC_OVERLAP = 30
+
+# days soft deleted rows are kept before purge_deleted removes them
+SOFT_DELETE_RETENTION_DAYS = int(os.getenv("SOFT_DELETE_RETENTION_DAYS", 30))
+
+# raise instead of logging a warning when a bot handler runs more queries
+# than its declared budget, meant for local runs
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT") == "1"
+
+# local listener of the bot Prometheus metrics, port 0 disables it. Worker N
+# of telegram_bot --workers listens on this port + N
+BOT_METRICS_HOST = os.getenv("BOT_METRICS_HOST", "127.0.0.1")
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", 9108))
+
+# file the bot appends OTLP/JSON trace spans to, unset disables tracing
+BOT_TRACE_FILE = os.getenv("BOT_TRACE_FILE")
+
+# threads (and so database connections) used by the bot for ORM calls
+BOT_DB_THREADS = int(os.getenv("BOT_DB_THREADS", 10))
+
+# seconds between write-behind flushes of bot user data and conversations
+BOT_PERSISTENCE_INTERVAL = 10
+# seconds after which data of an idle user is evicted from bot memory
+BOT_SESSION_IDLE_TIMEOUT = 30 * 60
+
+# users whose worker is remembered by the sharding dispatcher
+BOT_DISPATCHER_OWNERS_SIZE = 100000
+
+# updates processed at the same time, one user's updates are always sequential
+BOT_CONCURRENT_UPDATES = 32
+# updates taken from the update queue and waiting for their user or a slot
+BOT_PENDING_UPDATES = 4096
+
+# seconds the in-process catalog may serve data changed by other processes,
+# changes made in this process invalidate it at once
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", 60))
+
+# Telegram flood limits of outgoing messages, per bot process: messages per
+# second overall and per chat, and messages a chat may get in one burst
+BOT_RATE_LIMIT = 30
+BOT_CHAT_RATE_LIMIT = 1
+BOT_CHAT_RATE_BURST = 3
+# retries of a request answered with RetryAfter
+BOT_RATE_LIMIT_RETRIES = 3
@@ -1,186 +1,124 @@
+import asyncio
+import hmac
+import logging
+
 from django.conf import settings
-from django.utils.translation import gettext_lazy as _
-
-from telegram.ext import (
-    MessageHandler,
-    # Filters,
-    # Dispatcher,
-    CommandHandler,
-    ConversationHandler,
-    CallbackContext,
-)
-from telegram import (
-    Update,
-    Bot,
-    KeyboardButton,
-    ReplyKeyboardMarkup,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
-)
-
-from common_users.models import CommonUser
-
-
-class BotCommandStatus:
-    """BotCommandStatus"""
-
-    UPDATE_PHONE = 0
-    START_CHAT = 1
-
-
-class TelegramBot(object):
-    help = _("Chat Bot")
-
-    @staticmethod
-    def start_command(update: Update, context: CallbackContext):
-        user, created = CommonUser.objects.get_or_create(
-            chat_id=update.message.chat_id
-        )
+from django.core.exceptions import ImproperlyConfigured
 
-        if created:
-            button_phone = KeyboardButton(
-                text=str(_("Submit phone number 📱️")), request_contact=True
-            )
-            keyboard = ReplyKeyboardMarkup(
-                keyboard=[[button_phone]],
-                resize_keyboard=True,
-                one_time_keyboard=True,
-            )
-            update.message.reply_text(
-                text=str(
-                    _("To enter, click the 'Submit phone number' button")
-                ),
-                reply_markup=keyboard,
-            )
-            return BotCommandStatus.UPDATE_PHONE
-
-        else:
-            keyboard = InlineKeyboardMarkup(
-                [
-                    [
-                        InlineKeyboardButton(
-                            "📋 Каталог", callback_data="catalog"
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            "🛒Корзина", callback_data="Корзина"
-                        )
-                    ],
-                    [InlineKeyboardButton("🗣 FAQ", callback_data="faq")],
-                ]
-            )
-            text = "Выберете действие:"
-            update.message.reply_text(
-                text=text,
-                reply_markup=keyboard,
-            )
-            return BotCommandStatus.START_CHAT
-
-    @staticmethod
-    def update_phone(update: Update, context: CallbackContext):
-        phone = update.message.contact.phone_number
-        # check manager exist
-        CommonUser.objects.filter(chat_id=update.message.chat_id).update(
-            phone=phone,
-            first_name=update.message.contact.first_name,
-            last_name=update.message.contact.last_name,
-        )
-        keyboard = InlineKeyboardMarkup(
-            [
-                [InlineKeyboardButton("📋 Каталог", callback_data="catalog")],
-                [InlineKeyboardButton("🛒Корзина", callback_data="Корзина")],
-                [InlineKeyboardButton("🗣 FAQ", callback_data="faq")],
-            ]
-        )
-        text = "Выберете действие:"
-        update.message.reply_text(
-            text=text,
-            reply_markup=keyboard,
+from telegram import Update
+
+from services.telegram_ingest import UpdateConsumer, enqueue_telegram_update
+
+logger = logging.getLogger(__name__)
+
+# bot application running inside the ASGI event loop in webhook mode
+webhook_application = None
+webhook_consumer = None
+webhook_loop = None
+
+
+async def start_webhook_application():
+    """start bot application and register webhook"""
+    global webhook_application, webhook_consumer, webhook_loop
+
+    if not settings.TELEGRAM_WEBHOOK_ENABLED:
+        return
+
+    if not settings.TELEGRAM_WEBHOOK_SECRET:
+        raise ImproperlyConfigured(
+            "TELEGRAM_WEBHOOK_SECRET is required in webhook mode"
         )
 
-        return BotCommandStatus.START_CHAT
+    from common_users.management.commands.telegram_bot import (
+        build_application,
+    )
+
+    application = build_application(webhook=True)
+    await application.initialize()
+
+    if application.post_init:
+        await application.post_init(application)
+
+    await application.start()
+    await application.bot.set_webhook(
+        url=settings.TELEGRAM_WEBHOOK_URL,
+        secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+    )
+
+    webhook_consumer = UpdateConsumer(application)
+    webhook_consumer.start()
+
+    webhook_application = application
+    webhook_loop = asyncio.get_running_loop()
+    logger.info("Telegram webhook set to %s", settings.TELEGRAM_WEBHOOK_URL)
+
 
-    @staticmethod
-    def end_chat(update: Update, context: CallbackContext):
-        return ConversationHandler.END
+async def stop_webhook_application():
+    """stop bot application"""
+    global webhook_application, webhook_consumer, webhook_loop
 
-    @staticmethod
-    def start_chat(update: Update, context: CallbackContext):
+    application = webhook_application
+
+    if application is None:
         return
 
-        # if update.message.text == "/start":
-        #     # ignore /start text command
-        #     return
-
-        # chat_info = cache.get(f"telegram_chat_{update.message.chat_id}")
-
-        # if chat_info is None:
-        #     # if the data is not in the cache,
-        #     # restart the chat to update the data in the cache
-        #     update.message.reply_text(
-        #         str(
-        #             _(
-        #                 "Sorry, an error occurred, "
-        #                 "please try sending your phone number again"
-        #             )
-        #         ),
-        #     )
-        #     return TelegramBot.start(update, context)
-
-        # save chat and send message in socket
-        # chat_history_data = {
-        #     "room_name": chat_info["active_chat_id"],
-        #     "message": update.message.text,
-        #     "sender_id": chat_info["manager_id"],
-        # }
-        # if update.message.photo:
-        #     # generates uuid file name and
-        #     # downloads photo in media root directory
-        #     photo = update.message.photo[-1].file_id
-        #     image_name = "{}/{}.jpg".format(CHAT_IMAGE_PATH, uuid.uuid4())
-        #     media_path = "{}/{}".format(settings.MEDIA_ROOT, image_name)
-        #     context.bot.get_file(photo).download(custom_path=media_path)
-        #     chat_history_data["image"] = image_name
-
-
-def setup_dispatcher(dispatchers):
-    """
-    Adding handlers for events from Telegram
-    """
-    # conversation_handler = ConversationHandler(
-    #     entry_points=[CommandHandler("start", TelegramBot.start_command)],
-    #     states={
-    #         BotCommandStatus.UPDATE_PHONE: [
-    #             MessageHandler(Filters.contact, TelegramBot.update_phone)
-    #         ],
-    #         BotCommandStatus.START_CHAT: [
-    #             MessageHandler(
-    #                 Filters.text | Filters.command | Filters.photo,
-    #                 TelegramBot.start_chat,
-    #             )
-    #         ],
-    #     },
-    #     fallbacks=[CommandHandler("end_chat", TelegramBot.end_chat)],
-    # )
-
-    # dispatchers.add_handler(conversation_handler)
-
-    return dispatchers
-
-
-if settings.TELEGRAM_BOT_TOKEN:
-    bot = Bot(settings.TELEGRAM_BOT_TOKEN)
-
-    # dispatcher = setup_dispatcher(
-    # Dispatcher(
-    #     bot,
-    #     update_queue=None,
-    # )
-    # )
+    consumer = webhook_consumer
+    webhook_application = None
+    webhook_consumer = None
+    webhook_loop = None
+
+    await consumer.stop()
+    await application.stop()
+
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+    await application.shutdown()
+
+
+async def lifespan(receive, send):
+    """ASGI lifespan protocol handler running the bot with the web app"""
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            try:
+                await start_webhook_application()
+            except Exception as exc:
+                logger.exception("Failed to start telegram bot")
+                await send(
+                    {"type": "lifespan.startup.failed", "message": str(exc)}
+                )
+                return
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            await stop_webhook_application()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def check_webhook_secret(secret_token):
+    """check X-Telegram-Bot-Api-Secret-Token header value"""
+    expected = settings.TELEGRAM_WEBHOOK_SECRET
+
+    if not expected or not secret_token:
+        return False
+    return hmac.compare_digest(secret_token.encode(), expected.encode())
 
 
 def process_telegram_event(update_json):
-    # processing current command states
-    Update.de_json(update_json, bot)
-    # dispatcher.process_update(update)
+    """
+    Store webhook update for the consumer.
+
+    Runs in the webhook view, the update is only acknowledged once it is
+    persisted, so processing happens outside of Telegram's request.
+    """
+    if not enqueue_telegram_update(update_json):
+        return False
+
+    if webhook_loop is not None:
+        # webhook view runs in a worker thread, the consumer in the ASGI loop
+        webhook_loop.call_soon_threadsafe(webhook_consumer.wake)
+    return True
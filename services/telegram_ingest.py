@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from threading import Lock
+
+from django.conf import settings
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from telegram import Update
+
+from common_users.models import TelegramUpdate
+from common_users.services.application import reload_all_conversations
+from common_users.services.db import database_sync_to_async
+from common_users.services.leader import LeaderLease
+from common_users.services.metrics import (
+    INGEST_INFLIGHT,
+    INGEST_LAG_SECONDS,
+    INGEST_QUEUE_DEPTH,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SeenUpdates(object):
+    """Bounded LRU index of recently stored update ids"""
+
+    def __init__(self, size):
+        self.size = size
+        self._ids = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, update_id):
+        with self._lock:
+            return update_id in self._ids
+
+    def add(self, update_id):
+        with self._lock:
+            self._ids[update_id] = None
+            self._ids.move_to_end(update_id)
+            if len(self._ids) > self.size:
+                self._ids.popitem(last=False)
+
+
+seen_updates = SeenUpdates(settings.TELEGRAM_SEEN_UPDATES)
+
+
+def get_update_user_id(update_json):
+    """returns id of the user who sent the update"""
+    for value in update_json.values():
+        if isinstance(value, dict) and "from" in value:
+            return value["from"]["id"]
+    return None
+
+
+def enqueue_telegram_update(update_json):
+    """
+    Durably store webhook update, returns False for duplicates.
+
+    Telegram redelivers the same update_id when it does not get a quick 2xx,
+    the in-memory index and the unique update_id column drop those copies.
+    """
+    update_id = update_json.get("update_id")
+
+    if update_id is None or update_id in seen_updates:
+        return False
+
+    _, created = TelegramUpdate.all_objects.get_or_create(
+        update_id=update_id,
+        defaults={
+            "telegram_user_id": get_update_user_id(update_json),
+            "payload": update_json,
+        },
+    )
+    seen_updates.add(update_id)
+    return created
+
+
+@database_sync_to_async
+def get_pending_updates(limit, exclude=()):
+    """returns oldest pending updates, except those in ``exclude``"""
+    return list(
+        TelegramUpdate.objects.filter(is_processed=False)
+        .exclude(id__in=list(exclude))
+        .order_by("update_id")
+        .values("id", "telegram_user_id", "payload")[:limit]
+    )
+
+
+@database_sync_to_async
+def mark_updates_processed(ids):
+    """mark updates processed"""
+    TelegramUpdate.objects.filter(id__in=ids).update(is_processed=True)
+
+
+@database_sync_to_async
+def delete_processed_updates():
+    """delete processed updates older than the retention period"""
+    created_before = timezone.now() - timedelta(
+        hours=settings.TELEGRAM_UPDATES_RETENTION
+    )
+    deleted, _ = TelegramUpdate.objects.filter(
+        is_processed=True, created__lt=created_before
+    ).delete()
+    return deleted
+
+
+@database_sync_to_async
+def get_ingest_stats():
+    """returns pending updates count and age of the oldest one in seconds"""
+    pending = TelegramUpdate.objects.filter(is_processed=False).aggregate(
+        depth=Count("id"), oldest=Min("created")
+    )
+    lag = 0
+
+    if pending["oldest"]:
+        lag = (timezone.now() - pending["oldest"]).total_seconds()
+
+    return {"depth": pending["depth"], "lag": lag}
+
+
+class UpdateConsumer(object):
+    """
+    Drains stored webhook updates into the bot application.
+
+    Only the instance holding the ingest lease consumes. Every user gets a
+    worker task processing their updates strictly in update_id order, so a
+    slow user never holds back the others. Up to
+    TELEGRAM_INGEST_BATCH_SIZE updates are in flight at once, and up to
+    TELEGRAM_INGEST_CONCURRENCY of them are processed concurrently.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.lease = LeaderLease(
+            "telegram_ingest", settings.TELEGRAM_INGEST_LEASE_TTL
+        )
+        self.stats = {"depth": 0, "lag": 0}
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(
+            settings.TELEGRAM_INGEST_CONCURRENCY
+        )
+        self._task = None
+        # telegram user id -> rows waiting for the user's worker
+        self._user_rows = {}
+        self._workers = {}
+        # ids of dispatched rows not marked processed yet
+        self._inflight = set()
+        self._renewed_at = 0
+        self._is_leader = False
+        self._measured_at = 0
+        self._cleaned_at = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        tasks = [self._task, *self._workers.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await database_sync_to_async(self.lease.release)()
+
+    def wake(self):
+        """wake consumer up, call from the consumer event loop"""
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                dispatched = await self.consume()
+            except Exception:
+                logger.exception("Failed to consume telegram updates")
+                dispatched = 0
+
+            if not dispatched:
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(),
+                        settings.TELEGRAM_INGEST_POLL_INTERVAL,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def consume(self):
+        """hand new pending updates to user workers, returns their count"""
+        if not await self.renew_lease():
+            return 0
+
+        await self.maintain()
+
+        free = settings.TELEGRAM_INGEST_BATCH_SIZE - len(self._inflight)
+        if free <= 0:
+            return 0
+
+        rows = await get_pending_updates(free, exclude=self._inflight)
+
+        for row in rows:
+            user_id = row["telegram_user_id"]
+            self._inflight.add(row["id"])
+            self._user_rows.setdefault(user_id, deque()).append(row)
+
+            if user_id not in self._workers:
+                self._workers[user_id] = asyncio.create_task(
+                    self.process_user_updates(user_id)
+                )
+
+        INGEST_INFLIGHT.set(len(self._inflight))
+        return len(rows)
+
+    async def process_user_updates(self, user_id):
+        rows = self._user_rows[user_id]
+        processed = []
+
+        try:
+            while rows:
+                row = rows[0]
+                async with self._semaphore:
+                    try:
+                        await self.application.process_update(
+                            Update.de_json(
+                                row["payload"], self.application.bot
+                            )
+                        )
+                    except Exception:
+                        # retrying would block the user's later updates
+                        logger.exception(
+                            "Failed to process telegram update %s",
+                            row["id"],
+                        )
+                rows.popleft()
+                processed.append(row["id"])
+        finally:
+            del self._user_rows[user_id]
+            del self._workers[user_id]
+
+            if processed:
+                await mark_updates_processed(processed)
+            self._inflight.difference_update(processed)
+            INGEST_INFLIGHT.set(len(self._inflight))
+            self.wake()
+
+    async def renew_lease(self):
+        now = time.monotonic()
+
+        if now - self._renewed_at >= settings.TELEGRAM_INGEST_LEASE_TTL / 3:
+            self._renewed_at = now
+            is_leader = await database_sync_to_async(self.lease.acquire)()
+
+            if is_leader and not self._is_leader:
+                await self.take_over()
+            self._is_leader = is_leader
+
+        return self._is_leader
+
+    async def take_over(self):
+        """
+        drop user state cached before this term as leader, another instance
+        may have changed it meanwhile
+        """
+        # workers of the previous term still use the cached state
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+        self.application.persistence.forget_all_users()
+        await reload_all_conversations(self.application)
+        logger.info("Took over the telegram ingest lease")
+
+    async def maintain(self):
+        """refresh queue metrics and drop old processed updates"""
+        now = time.monotonic()
+
+        if now - self._measured_at >= settings.TELEGRAM_INGEST_STATS_INTERVAL:
+            self._measured_at = now
+            self.stats = await get_ingest_stats()
+            INGEST_QUEUE_DEPTH.set(self.stats["depth"])
+            INGEST_LAG_SECONDS.set(self.stats["lag"])
+
+        if now - self._cleaned_at < 60:
+            return
+
+        self._cleaned_at = now
+        deleted = await delete_processed_updates()
+        logger.info(
+            "Telegram ingest queue depth %s, lag %.1fs, %s old updates deleted",
+            self.stats["depth"],
+            self.stats["lag"],
+            deleted,
+        )